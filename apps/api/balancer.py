@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from cache import TTLCache
+from resilience import OPEN, CircuitBreaker
+
+logger = logging.getLogger("per4ex.api")
+
+
+class Upstream:
+    """One backend instance with its open-stream count, health and breaker."""
+
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url.rstrip("/")
+        self.breaker = breaker
+        self.active = 0
+        self.requests = 0
+        self.healthy = True
+        self._probe_failures = 0
+        self._probe_successes = 0
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            "active": self.active,
+            "requests": self.requests,
+            "healthy": self.healthy,
+            "breaker": self.breaker.stats(),
+        }
+
+
+class UpstreamPool:
+    """Routes each new stream to the upstream with the fewest open streams.
+
+    A ``session_id`` sticks to the upstream that served it last as long as
+    that upstream is healthy and its breaker lets calls through. Active
+    probes eject an upstream after ``unhealthy_after`` consecutive failures
+    and reinstate it after ``healthy_after`` consecutive successes; if every
+    upstream is ejected, all of them are tried rather than failing outright.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        breaker_factory: Callable[[], CircuitBreaker] = CircuitBreaker,
+        unhealthy_after: int = 2,
+        healthy_after: int = 2,
+        affinity_ttl: float = 1800.0,
+        affinity_max_entries: int = 10000,
+    ):
+        if not urls:
+            raise ValueError("At least one upstream URL is required")
+        self.upstreams = [Upstream(url, breaker_factory()) for url in urls]
+        self.unhealthy_after = unhealthy_after
+        self.healthy_after = healthy_after
+        # session_id -> url of the upstream that holds the session
+        self._affinity = TTLCache(max_entries=affinity_max_entries, ttl=affinity_ttl)
+
+    def _candidates(self, session_id: Optional[str]) -> List[Upstream]:
+        healthy = [u for u in self.upstreams if u.healthy] or self.upstreams
+        candidates = sorted(
+            (u for u in healthy if u.breaker.state != OPEN),
+            key=lambda u: (u.active, u.requests),
+        )
+        if session_id is not None:
+            pinned = self._affinity.get(session_id)
+            for i, upstream in enumerate(candidates):
+                if upstream.url == pinned:
+                    candidates.insert(0, candidates.pop(i))
+                    break
+        return candidates
+
+    def acquire(self, session_id: Optional[str] = None) -> Optional[Upstream]:
+        """Pick an upstream and count a stream against it; ``None`` if none is available."""
+        for upstream in self._candidates(session_id):
+            if upstream.breaker.allow():
+                upstream.active += 1
+                upstream.requests += 1
+                if session_id is not None:
+                    self._affinity.set(session_id, upstream.url)
+                return upstream
+        return None
+
+    def release(self, upstream: Upstream) -> None:
+        upstream.active -= 1
+
+    def record_probe(self, upstream: Upstream, ok: bool) -> None:
+        if ok:
+            upstream._probe_failures = 0
+            upstream._probe_successes += 1
+            if not upstream.healthy and upstream._probe_successes >= self.healthy_after:
+                upstream.healthy = True
+                logger.info("Upstream %s is healthy again", upstream.url)
+        else:
+            upstream._probe_successes = 0
+            upstream._probe_failures += 1
+            if upstream.healthy and upstream._probe_failures >= self.unhealthy_after:
+                upstream.healthy = False
+                logger.warning("Upstream %s failed %d health checks; ejecting", upstream.url, upstream._probe_failures)
+
+    async def probe(self, client: httpx.AsyncClient, path: str = "/health", timeout: float = 2.0) -> None:
+        async def check(upstream: Upstream):
+            try:
+                resp = await client.get(f"{upstream.url}{path}", timeout=timeout)
+                ok = resp.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            self.record_probe(upstream, ok)
+
+        await asyncio.gather(*(check(u) for u in self.upstreams))
+
+    def stats(self) -> List[Dict[str, object]]:
+        return [u.stats() for u in self.upstreams]
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Per-turn overhead of /api/chat (POST + SSE) versus /ws/chat (WebSocket).
+
+Starts the app under uvicorn on a local port with a canned in-process
+Catalyst stub, then runs the same sequence of turns over each transport:
+one keep-alive HTTP client posting each turn, and one WebSocket carrying
+every turn. Reports latency per turn and bytes received per turn.
+
+    python bench/chat_transport.py [--turns 500] [--events 20]
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+import websockets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import main  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def install_stub(events):
+    body = b"".join(b'data: {"token": "word %d "}\n\n' % i for i in range(events)) + b"data: [DONE]\n\n"
+    main._http_clients["catalyst"] = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+    )
+    main.CATALYST_API_KEY = "bench"
+    # Measure transport cost, not the limits
+    main._chat_session_limiter = main.RateLimiter(0, 0)
+    main._chat_ip_limiter = main.RateLimiter(0, 0)
+
+
+async def sse_turns(base_url, turns):
+    latencies, received = [], 0
+    async with httpx.AsyncClient(base_url=base_url) as http:
+        for i in range(turns):
+            started = time.perf_counter()
+            async with http.stream("POST", "/api/chat", json={"message": f"q{i}", "session_id": "bench"}) as resp:
+                async for chunk in resp.aiter_raw():
+                    received += len(chunk)
+                # Status line and headers are paid on every turn
+                received += sum(len(k) + len(v) + 4 for k, v in resp.headers.raw) + 17
+            latencies.append(time.perf_counter() - started)
+    return latencies, received
+
+
+async def ws_turns(ws_url, turns):
+    latencies, received = [], 0
+    async with websockets.connect(ws_url) as ws:
+        for i in range(turns):
+            started = time.perf_counter()
+            await ws.send(json.dumps({"id": str(i), "message": f"q{i}", "session_id": "bench"}))
+            while True:
+                frame = await ws.recv()
+                received += len(frame) + 2  # plus the minimal frame header
+                if json.loads(frame).get("done"):
+                    break
+            latencies.append(time.perf_counter() - started)
+    return latencies, received
+
+
+def report(name, latencies, received):
+    latencies = sorted(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e3
+    print(
+        f"{name:<12}{statistics.mean(latencies) * 1e3:>10.2f}{p(0.5):>10.2f}{p(0.95):>10.2f}"
+        f"{received / len(latencies):>14.0f}"
+    )
+
+
+async def run(turns, events):
+    install_stub(events)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        # Warm both paths before measuring
+        await sse_turns(f"http://127.0.0.1:{port}", 20)
+        await ws_turns(f"ws://127.0.0.1:{port}/ws/chat", 20)
+        print(f"{turns} sequential turns, {events} events per answer")
+        print(f"{'transport':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'bytes/turn':>14}")
+        report("sse", *await sse_turns(f"http://127.0.0.1:{port}", turns))
+        report("websocket", *await ws_turns(f"ws://127.0.0.1:{port}/ws/chat", turns))
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--events", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.turns, args.events))
+
+
+if __name__ == "__main__":
+    main_cli()
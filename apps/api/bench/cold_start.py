@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Cold-start cost of the API: module import plus the first requests.
+
+Each run starts a fresh interpreter (as a serverless cold start would),
+imports main, then sends /health and /api/github/repos (answered from a
+warm-start snapshot) straight to the ASGI app without running the
+lifespan handler. Reports the median and worst of each phase; with
+--budget-ms the run fails if the median total exceeds the budget.
+
+    python bench/cold_start.py [--runs 10] [--budget-ms 1500] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+API_DIR = Path(__file__).resolve().parent.parent
+
+# Modules that should stay off the cold-start path
+LAZY_MODULES = ("numpy", "h2")
+
+PROBE = r"""
+import asyncio, json, sys, time
+
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+
+async def call(path, query=b""):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query,
+        "root_path": "", "headers": [], "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await main.app(scope, receive, send)
+    return status[0]
+
+
+async def requests():
+    marks = []
+    assert await call("/health") == 200
+    marks.append(time.perf_counter())
+    assert await call("/api/github/repos", b"user=snapshot-user") == 200
+    marks.append(time.perf_counter())
+    return marks
+
+
+health, repos = asyncio.run(requests())
+print(json.dumps({
+    "import_ms": (imported - started) * 1e3,
+    "first_health_ms": (health - imported) * 1e3,
+    "first_repos_ms": (repos - health) * 1e3,
+    "total_ms": (repos - started) * 1e3,
+    "lazy_modules_loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def write_snapshot(path, repo_count=100):
+    sys.path.insert(0, str(API_DIR))
+    import main
+
+    repos = [
+        main.Repo(
+            name=f"repo-{i}",
+            html_url=f"https://github.com/snapshot-user/repo-{i}",
+            stargazers_count=i,
+            updated_at=f"2025-01-{i % 28 + 1:02d}T00:00:00Z",
+        )
+        for i in range(repo_count)
+    ]
+    entry = main.RepoCacheEntry(user="snapshot-user", repos=repos, fetched_at=time.time())
+    Path(path).write_bytes(entry.to_bytes() + b"\n")
+
+
+def run_once(snapshot):
+    env = dict(
+        os.environ,
+        GITHUB_CACHE_SNAPSHOT=snapshot,
+        # Nothing listens here, so an accidental GitHub call fails fast instead of hanging
+        GITHUB_API_URL="http://127.0.0.1:9",
+        CACHE_BACKEND_URL="",
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE % (LAZY_MODULES,)],
+        cwd=API_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    summary = {}
+    for key in ("import_ms", "first_health_ms", "first_repos_ms", "total_ms"):
+        values = [r[key] for r in runs]
+        summary[key] = {"median": round(statistics.median(values), 1), "max": round(max(values), 1)}
+    summary["lazy_modules_loaded"] = sorted({m for r in runs for m in r["lazy_modules_loaded"]})
+    return summary
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if the median total exceeds this")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "repos.snapshot")
+        write_snapshot(snapshot)
+        summary = summarize([run_once(snapshot) for _ in range(args.runs)])
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print(f"{args.runs} cold starts")
+        print(f"{'phase':<18}{'median ms':>12}{'max ms':>10}")
+        for key in ("import_ms", "first_health_ms", "first_repos_ms", "total_ms"):
+            print(f"{key[:-3]:<18}{summary[key]['median']:>12}{summary[key]['max']:>10}")
+        print("lazy modules loaded:", ", ".join(summary["lazy_modules_loaded"]) or "none")
+
+    failed = bool(summary["lazy_modules_loaded"])
+    if args.budget_ms is not None and summary["total_ms"]["median"] > args.budget_ms:
+        print(f"Cold start {summary['total_ms']['median']} ms is over the {args.budget_ms} ms budget", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
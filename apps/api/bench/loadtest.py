@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Load test /api/github/repos and /api/chat against local upstream stubs.
+
+Starts bench/stubs.py and the API (uvicorn, separate processes) on free
+local ports, so no network access is needed. Then, for each scenario and
+concurrency level, runs closed-loop clients for a fixed duration and
+reports RPS, latency percentiles and time to first byte. Results are
+written as JSON; with --baseline, any scenario whose RPS dropped or whose
+p95 latency / TTFB rose by more than --tolerance is flagged and the exit
+status is 1.
+
+    python bench/loadtest.py [--scenario repos chat] [--concurrency 1 10 50]
+        [--duration 10] [--output bench/results/latest.json]
+        [--baseline bench/results/baseline.json] [--save-baseline]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+API_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def start_process(args, env=None):
+    # Log to a file rather than a pipe nobody reads, which could fill up and block the server
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen([sys.executable, *args], cwd=API_DIR, env=env, stdout=log, stderr=log)
+    process.log = log
+    return process
+
+
+def process_log(process):
+    process.log.seek(0)
+    return process.log.read().decode(errors="replace")
+
+
+async def wait_ready(url, process, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited early:\n{process_log(process)}")
+            try:
+                await http.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def repos_request(http, worker, i, users):
+    user = f"user{(worker + i) % users}"
+    started = time.perf_counter()
+    async with http.stream("GET", "/api/github/repos", params={"user": user}) as resp:
+        ttfb = None
+        async for _ in resp.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - started
+    return resp.status_code == 200, time.perf_counter() - started, ttfb
+
+
+async def chat_request(http, worker, i, users):
+    started = time.perf_counter()
+    body = {"message": f"question {i}", "session_id": f"load-{worker}"}
+    async with http.stream("POST", "/api/chat", json=body) as resp:
+        ttfb = None
+        ok = resp.status_code == 200
+        async for chunk in resp.aiter_raw():
+            # The first real event, not a keep-alive comment
+            if ttfb is None and b"data:" in chunk:
+                ttfb = time.perf_counter() - started
+            if b'"error"' in chunk:
+                ok = False
+    return ok, time.perf_counter() - started, ttfb
+
+
+SCENARIOS = {"repos": repos_request, "chat": chat_request}
+
+
+async def run_level(base_url, scenario, concurrency, duration, users):
+    request = SCENARIOS[scenario]
+    latencies, ttfbs = [], []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    timeout = httpx.Timeout(120.0)
+    stop_at = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as http:
+        async def worker(n):
+            nonlocal errors
+            i = 0
+            while time.perf_counter() < stop_at:
+                try:
+                    ok, latency, ttfb = await request(http, n, i, users)
+                except httpx.HTTPError:
+                    ok, latency, ttfb = False, None, None
+                i += 1
+                if not ok:
+                    errors += 1
+                    continue
+                latencies.append(latency)
+                if ttfb is not None:
+                    ttfbs.append(ttfb)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ms = lambda v: round(v * 1e3, 2) if v is not None else None
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": ms(percentile(latencies, 0.5)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "ttfb_p50_ms": ms(percentile(ttfbs, 0.5)),
+        "ttfb_p95_ms": ms(percentile(ttfbs, 0.95)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions of ``results`` against ``baseline``."""
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        base = previous.get((r["scenario"], r["concurrency"]))
+        if base is None:
+            continue
+        name = f"{r['scenario']}@{r['concurrency']}"
+        if base["rps"] and r["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {r['rps']}")
+        for key in ("p95_ms", "ttfb_p95_ms"):
+            if base.get(key) and r.get(key) and r[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {base[key]} -> {r[key]}")
+    return regressions
+
+
+def print_table(results):
+    columns = ("scenario", "concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms",
+               "ttfb_p50_ms", "ttfb_p95_ms")
+    print("".join(f"{c:>13}" for c in columns))
+    for r in results:
+        print("".join(f"{'-' if r[c] is None else r[c]:>13}" for c in columns))
+
+
+async def run(args):
+    stub_port, api_port = free_port(), free_port()
+    stubs = start_process([
+        "bench/stubs.py", "--port", str(stub_port),
+        "--repos", str(args.repos), "--github-latency", str(args.github_latency),
+        "--tokens", str(args.tokens), "--token-rate", str(args.token_rate),
+        "--stall-rate", str(args.stall_rate), "--stall", str(args.stall),
+    ])
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("GITHUB_", "CATALYST_", "CHAT_"))}
+    env.update(
+        GITHUB_API_URL=f"http://127.0.0.1:{stub_port}/github",
+        GITHUB_TOKEN="",
+        CATALYST_BASE_URL=f"http://127.0.0.1:{stub_port}/catalyst/v1",
+        CATALYST_API_KEY="loadtest",
+        # Measure the service, not its abuse limits
+        CHAT_SESSION_RATE_PER_MIN="0",
+        CHAT_IP_RATE_PER_MIN="0",
+        CHAT_MAX_CONCURRENT=str(max(args.concurrency) * 2),
+        CACHE_BACKEND_URL="",
+    )
+    api = start_process(
+        ["-m", "uvicorn", "main:app", "--port", str(api_port), "--log-level", "warning",
+         "--workers", str(args.workers)],
+        env=env,
+    )
+    try:
+        await wait_ready(f"http://127.0.0.1:{stub_port}/catalyst/v1/health", stubs)
+        await wait_ready(f"http://127.0.0.1:{api_port}/health", api)
+        base_url = f"http://127.0.0.1:{api_port}"
+        results = []
+        for scenario in args.scenario:
+            # Fill caches and connection pools; these numbers are discarded
+            await run_level(base_url, scenario, max(args.concurrency), args.warmup, args.users)
+            for concurrency in args.concurrency:
+                result = await run_level(base_url, scenario, concurrency, args.duration, args.users)
+                results.append(result)
+                print(f"{scenario}@{concurrency}: {result['rps']} rps, p95 {result['p95_ms']} ms", file=sys.stderr)
+        return results
+    finally:
+        for process in (api, stubs):
+            process.terminate()
+            process.wait(timeout=10)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=["repos", "chat"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario and level")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the API")
+    parser.add_argument("--users", type=int, default=5, help="distinct GitHub users to spread requests over")
+    parser.add_argument("--repos", type=int, default=250)
+    parser.add_argument("--github-latency", type=float, default=0.05)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-rate", type=float, default=200.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall", type=float, default=2.0)
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR / "latest.json")
+    parser.add_argument("--baseline", type=Path, default=RESULTS_DIR / "baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before flagging")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_table(results)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "options": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        "results": results,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2))
+        return
+
+    if args.baseline.exists():
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print("\nRegressions against", args.baseline)
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("\nNo regressions against", args.baseline)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Per-hit CPU cost of /api/github/repos cache hits.
+
+Compares the pre-encoded path (unfiltered listing, bytes served as stored)
+with the serialized path (same repos via ?limit=100, which goes through
+pydantic validation and JSON encoding on every request).
+
+    python bench/repo_cache_hits.py [--repos 100] [--requests 2000]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import main  # noqa: E402
+
+
+def fake_repos(count):
+    return [
+        {
+            "name": f"repo-{i}",
+            "description": f"Synthetic repository number {i} used for benchmarking",
+            "html_url": f"https://github.com/bench/repo-{i}",
+            "language": ("Python", "TypeScript", "Go", None)[i % 4],
+            "stargazers_count": i * 3,
+            "updated_at": f"2025-01-{i % 28 + 1:02d}T00:00:00Z",
+        }
+        for i in range(count)
+    ]
+
+
+async def call(app, params, headers):
+    # Drive the ASGI app directly so no HTTP client cost ends up in the numbers
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/github/repos",
+        "raw_path": b"/api/github/repos",
+        "query_string": urlencode(params).encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def measure(params, headers, requests):
+    start_cpu = time.process_time()
+    start_wall = time.perf_counter()
+    for _ in range(requests):
+        assert await call(main.app, params, headers) == 200
+    cpu = time.process_time() - start_cpu
+    wall = time.perf_counter() - start_wall
+    return cpu / requests * 1e6, wall / requests * 1e6
+
+
+async def run(repo_count, requests):
+    repos = fake_repos(repo_count)
+    main._http_clients["github"] = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json=repos))
+    )
+    # Warm the cache
+    await call(main.app, {"user": "bench"}, {})
+
+    cases = [
+        ("serialized (?limit=100)", {"user": "bench", "limit": 100}, {"Accept-Encoding": "identity"}),
+        ("pre-encoded identity", {"user": "bench"}, {"Accept-Encoding": "identity"}),
+        ("pre-encoded gzip", {"user": "bench"}, {"Accept-Encoding": "gzip"}),
+        ("pre-encoded br", {"user": "bench"}, {"Accept-Encoding": "br, gzip"}),
+    ]
+    print(f"{repo_count} repos, {requests} requests per case")
+    print(f"{'case':<28}{'cpu us/hit':>12}{'wall us/hit':>13}")
+    for name, params, headers in cases:
+        await measure(params, headers, requests // 10)
+        cpu, wall = await measure(params, headers, requests)
+        print(f"{name:<28}{cpu:>12.1f}{wall:>13.1f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repos", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.repos, args.requests))
+
+
+if __name__ == "__main__":
+    main_cli()
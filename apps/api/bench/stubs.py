@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Local stand-ins for the GitHub REST API and Catalyst, for load tests.
+
+Serves on one port:
+
+    /github/users/{user}/repos      paginated repo list (Link header, ETags)
+    /github/repos/{user}/{repo}/languages
+    /catalyst/v1/chat/stream        SSE answer at a fixed token rate
+    /catalyst/v1/health
+
+Point the API at it with GITHUB_API_URL=http://host:port/github and
+CATALYST_BASE_URL=http://host:port/catalyst/v1.
+
+    python bench/stubs.py --port 9100 [--repos 250] [--github-latency 0.05]
+        [--tokens 200] [--token-rate 50] [--stall-rate 0.05 --stall 2]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+
+def build_app(
+    repos: int = 250,
+    github_latency: float = 0.05,
+    first_token_latency: float = 0.3,
+    tokens: int = 200,
+    token_rate: float = 50.0,
+    stall_rate: float = 0.0,
+    stall: float = 2.0,
+    seed: int = 0,
+) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+
+    def repo_list(user: str):
+        return [
+            {
+                "name": f"{user}-repo-{i}",
+                "description": f"Stub repository {i}",
+                "html_url": f"https://github.com/{user}/{user}-repo-{i}",
+                "language": ("Python", "TypeScript", "Go", None)[i % 4],
+                "stargazers_count": (i * 7) % 500,
+                "updated_at": f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T00:00:00Z",
+                "pushed_at": f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}T00:00:00Z",
+                "topics": ["stub"],
+                "forks_count": i % 10,
+                "open_issues_count": i % 5,
+            }
+            for i in range(repos)
+        ]
+
+    @app.get("/github/users/{user}/repos")
+    async def github_repos(request: Request, user: str, page: int = 1, per_page: int = 30):
+        await asyncio.sleep(github_latency)
+        items = repo_list(user)
+        last = max(1, -(-len(items) // per_page))
+        body = json.dumps(items[(page - 1) * per_page:page * per_page]).encode()
+        etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        headers = {"ETag": etag, "X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "4999"}
+        if page < last:
+            base = str(request.url.remove_query_params("page"))
+            headers["Link"] = f'<{base}&page={page + 1}>; rel="next", <{base}&page={last}>; rel="last"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    @app.get("/github/repos/{user}/{repo}/languages")
+    async def github_languages(user: str, repo: str):
+        await asyncio.sleep(github_latency)
+        return {"Python": 1000, "Shell": 100}
+
+    @app.get("/catalyst/v1/health")
+    async def catalyst_health():
+        return {"status": "ok"}
+
+    @app.post("/catalyst/v1/chat/stream")
+    async def catalyst_stream():
+        async def events():
+            await asyncio.sleep(first_token_latency)
+            for i in range(tokens):
+                if stall_rate and rng.random() < stall_rate:
+                    await asyncio.sleep(stall)
+                yield f'data: {json.dumps({"token": f"tok{i} "})}\n\n'.encode()
+                if token_rate:
+                    await asyncio.sleep(1 / token_rate)
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--repos", type=int, default=250, help="repos per user")
+    parser.add_argument("--github-latency", type=float, default=0.05, help="seconds per GitHub request")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds before the first event")
+    parser.add_argument("--tokens", type=int, default=200, help="events per answer")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="events per second, 0 for no pacing")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="chance of a stall before each event")
+    parser.add_argument("--stall", type=float, default=2.0, help="stall length in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = build_app(
+        repos=args.repos,
+        github_latency=args.github_latency,
+        first_token_latency=args.first_token_latency,
+        tokens=args.tokens,
+        token_rate=args.token_rate,
+        stall_rate=args.stall_rate,
+        stall=args.stall,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,398 @@
+import asyncio
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+
+def approx_size(obj: Any, _seen: Optional[set] = None) -> int:
+    """Rough deep size of ``obj`` in bytes; good enough for cache budgeting."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_size(k, _seen) + approx_size(v, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approx_size(item, _seen)
+    elif hasattr(obj, "__dict__"):
+        size += approx_size(vars(obj), _seen)
+    return size
+
+
+class TTLCache:
+    """Bounded in-memory cache with LRU eviction and per-entry expiry.
+
+    Capped both by entry count and by an approximate byte budget. Expired
+    entries are dropped on access and periodically swept on writes.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = approx_size,
+        sweep_interval: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        # key -> (expires_at, size, value)
+        self._data: "OrderedDict[Hashable, Tuple[Optional[float], int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._last_sweep = clock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and not self._expired(item[0], self.clock())
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and now >= expires_at
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        if self._expired(item[0], self.clock()):
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[2]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        now = self.clock()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+        size = self.sizeof(value)
+
+        if key in self._data:
+            self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Never cache something that would evict everything else
+            self.evictions += 1
+            return
+
+        self._data[key] = (expires_at, size, value)
+        self._bytes += size
+
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+        self._evict()
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Unexpired value for ``key`` without touching recency or stats."""
+        item = self._data.get(key)
+        if item is None or self._expired(item[0], self.clock()):
+            return default
+        return item[2]
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Unexpired entries, oldest first, without touching recency or stats."""
+        now = self.clock()
+        return [(k, v) for k, (expires_at, _, v) in self._data.items() if not self._expired(expires_at, now)]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        self._remove(key)
+        return item[2]
+
+    def _evict(self) -> None:
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
+
+    def sweep(self) -> int:
+        """Drop every expired entry. Returns the number removed."""
+        now = self.clock()
+        self._last_sweep = now
+        expired = [k for k, (expires_at, _, _) in self._data.items() if self._expired(expires_at, now)]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class CacheBackend(ABC):
+    """Byte-oriented key/value store shared across processes.
+
+    Used as a second tier behind the in-process ``TTLCache`` so cached data
+    outlives a single worker or serverless cold start.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """Process-local backend; the default when nothing else is configured."""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None):
+        self._cache = TTLCache(max_entries=max_entries, max_bytes=max_bytes, sizeof=len)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self._cache.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str) -> None:
+        self._cache.pop(key)
+
+
+class SQLiteBackend(CacheBackend):
+    """On-disk backend, shared by every worker on the same machine."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def _set(self, key: str, value: bytes, ttl: Optional[float]) -> None:
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                # Purge expired rows every so often rather than on every write
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """Minimal RESP client covering the handful of commands the cache needs.
+
+    Works against Redis, Valkey, KeyDB or any other server speaking the Redis
+    protocol, without pulling in a client library.
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlsplit(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+        if self.password:
+            auth = [self.username, self.password] if self.username else [self.password]
+            await self._roundtrip("AUTH", *auth)
+        if self.db:
+            await self._roundtrip("SELECT", str(self.db))
+
+    async def _roundtrip(self, *args: Any) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await asyncio.wait_for(self._read_reply(), self.timeout)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise RedisError(payload.decode(errors="replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    async def execute(self, *args: Any) -> Any:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            connected = self._writer is not None
+            try:
+                if not connected:
+                    await self._connect()
+                    connected = True
+                return await self._roundtrip(*args)
+            except RedisError:
+                # An error reply to the command itself leaves the connection in
+                # sync; one to AUTH or SELECT leaves it half set up
+                if not connected:
+                    await self._disconnect()
+                raise
+            except BaseException:
+                # Timeouts, resets and cancellation can leave a reply unread, so
+                # drop the connection and let the next command reconnect
+                await self._disconnect()
+                raise
+
+    async def _disconnect(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.execute("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if ttl is not None:
+            await self.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+        else:
+            await self.execute("SET", key, value)
+
+    async def delete(self, key: str) -> None:
+        await self.execute("DEL", key)
+
+    async def close(self) -> None:
+        await self._disconnect()
+
+
+def backend_from_url(url: Optional[str]) -> CacheBackend:
+    """Build a backend from ``memory://``, ``sqlite:///path`` or ``redis://host:port/db``."""
+    if not url or url.startswith("memory:"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteBackend(url[len("sqlite:///"):] or ":memory:")
+    if url.startswith(("redis:", "valkey:")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported cache backend: {url}")
@@ -0,0 +1,16 @@
+import pytest
+
+
+class FakeClock:
+    """Manually advanced stand-in for time.monotonic/perf_counter."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,154 @@
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"[\w]+", re.UNICODE)
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.casefold())
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English under common BPE vocabularies;
+    # close enough for budgeting without running a real tokenizer.
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class Chunk:
+    title: str  # heading path, e.g. "2. Core Platform: Catalyst AI > Key Capabilities"
+    text: str
+    tokens: int = 0
+
+    def __post_init__(self):
+        if not self.tokens:
+            self.tokens = estimate_tokens(self.text)
+
+
+def split_markdown(markdown: str) -> List[Chunk]:
+    """Split a markdown document into one chunk per heading section."""
+    chunks: List[Chunk] = []
+    path: List[Tuple[int, str]] = []
+    lines: List[str] = []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body and path:
+            heading = path[-1]
+            text = f"{'#' * heading[0]} {heading[1]}\n{body}"
+            chunks.append(Chunk(title=" > ".join(h[1] for h in path), text=text))
+        lines.clear()
+
+    for line in markdown.splitlines():
+        match = _HEADING_RE.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, match.group(2)))
+        elif line.strip() != "---":
+            lines.append(line)
+    flush()
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a small corpus, with document weights precomputed.
+
+    The per-(document, term) BM25 weights are materialized once at build
+    time, so scoring a query is a column gather and a row sum. numpy is
+    imported on first use so it stays off the cold-start path.
+    """
+
+    def __init__(self, chunks: List[Chunk], k1: float = 1.5, b: float = 0.75):
+        import numpy as np
+
+        self.chunks = chunks
+        docs = [tokenize(f"{c.title}\n{c.text}") for c in chunks]
+        self.vocab: Dict[str, int] = {}
+        for doc in docs:
+            for term in doc:
+                self.vocab.setdefault(term, len(self.vocab))
+
+        tf = np.zeros((len(docs), max(1, len(self.vocab))), dtype=np.float32)
+        for i, doc in enumerate(docs):
+            ids, counts = np.unique([self.vocab[t] for t in doc], return_counts=True)
+            if len(ids):
+                tf[i, ids] = counts
+
+        n_docs = max(1, len(docs))
+        lengths = tf.sum(axis=1)
+        avg_length = float(lengths.mean()) if len(docs) else 1.0
+        df = (tf > 0).sum(axis=0)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-9))
+        self.weights = (idf * tf * (k1 + 1) / (tf + norm[:, None])).astype(np.float32)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[Chunk, float]]:
+        import numpy as np
+
+        ids = [self.vocab[t] for t in tokenize(query) if t in self.vocab]
+        if not ids or not self.chunks:
+            return []
+        scores = self.weights[:, ids].sum(axis=1)
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunks[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+class KnowledgeBase:
+    """BM25 index over a markdown file, rebuilt only when the file changes.
+
+    The file's mtime is checked at most once per ``check_interval`` seconds;
+    ``on_change`` is called after every rebuild that follows an edit.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        check_interval: float = 1.0,
+        on_change: Optional[Callable[[], None]] = None,
+    ):
+        self.path = path
+        self.check_interval = check_interval
+        self.on_change = on_change
+        self._index: Optional[BM25Index] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False) -> Optional[BM25Index]:
+        now = time.monotonic()
+        if not force and self._index is not None and now - self._checked_at < self.check_interval:
+            return self._index
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return self._index
+        if mtime == self._mtime and not force:
+            return self._index
+
+        with self._lock:
+            if mtime == self._mtime and not force:
+                return self._index
+            with open(self.path, encoding="utf-8") as f:
+                index = BM25Index(split_markdown(f.read()))
+            changed = self._mtime is not None
+            self._index, self._mtime = index, mtime
+        if changed and self.on_change is not None:
+            self.on_change()
+        return index
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[Chunk, float]]:
+        index = self.refresh()
+        if index is None:
+            return []
+        return index.search(query, k)
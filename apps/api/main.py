@@ -1,13 +1,126 @@
+import math
 import time
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Request
+import json
+import gzip
+import hashlib
+import importlib.util
+import ipaddress
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Annotated, AsyncIterator, Callable, List, Literal, Optional, Dict, Any, Tuple, Union
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.requests import HTTPConnection
+from starlette.websockets import WebSocketState
 import httpx
 import os
+import tempfile
 
-app = FastAPI(title="Per4ex API")
+from balancer import UpstreamPool
+from cache import CacheBackend, TTLCache, backend_from_url
+from kb import KnowledgeBase, estimate_tokens
+from metrics import Registry, RouteTimingMiddleware
+from resilience import CircuitBreaker, ConcurrencyLimiter, RateLimiter
+from sse import HEARTBEAT, Broadcast, ErrorEvent, SSEParser, error_event, event_data, relay_events
+from tracing import ProfileSampler, RequestIdFilter, RequestIdMiddleware, Trace, new_request_id, request_id_var
+
+# Only check that h2 is installed; httpx imports it when an HTTP/2 pool is built
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("per4ex.api")
+# Lets log formats include %(request_id)s
+logger.addFilter(RequestIdFilter())
+
+# Shared outbound HTTP clients, one pool per upstream host so each gets its own
+# connection limits. Created in the lifespan handler and reused by every request.
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1" and HTTP2_AVAILABLE
+HTTP_POOLS = {
+    "github": {
+        "max_connections": int(os.getenv("GITHUB_MAX_CONNECTIONS", "20")),
+        "max_keepalive_connections": int(os.getenv("GITHUB_MAX_KEEPALIVE", "10")),
+    },
+    "catalyst": {
+        "max_connections": int(os.getenv("CATALYST_MAX_CONNECTIONS", "100")),
+        "max_keepalive_connections": int(os.getenv("CATALYST_MAX_KEEPALIVE", "20")),
+    },
+}
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _build_http_client(name: str) -> httpx.AsyncClient:
+    pool = HTTP_POOLS[name]
+    limits = httpx.Limits(
+        max_connections=pool["max_connections"],
+        max_keepalive_connections=pool["max_keepalive_connections"],
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(limits=limits, http2=HTTP2_ENABLED)
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    # Lazily (re)create the pool if the lifespan handler did not run
+    # (e.g. serverless invocations or a bare TestClient).
+    client = _http_clients.get(name)
+    if client is None or client.is_closed:
+        client = _http_clients[name] = _build_http_client(name)
+    return client
+
+
+async def close_http_clients():
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+async def _probe_catalyst_upstreams():
+    while True:
+        await asyncio.sleep(CATALYST_HEALTH_INTERVAL)
+        try:
+            await _catalyst_upstreams.probe(get_http_client("catalyst"), CATALYST_HEALTH_PATH, CATALYST_CONNECT_TIMEOUT)
+        except Exception as e:
+            logger.warning("Catalyst health probes failed: %r", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for name in HTTP_POOLS:
+        get_http_client(name)
+    # Index the knowledge base off the event loop; startup doesn't wait for it
+    def kb_indexed(future: "asyncio.Future"):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Error indexing knowledge base %s: %s", KB_PATH, future.exception())
+
+    asyncio.get_running_loop().run_in_executor(None, _kb.refresh).add_done_callback(kb_indexed)
+    probes = None
+    if len(_catalyst_upstreams.upstreams) > 1 and CATALYST_HEALTH_INTERVAL > 0:
+        probes = asyncio.create_task(_probe_catalyst_upstreams())
+    yield
+    if probes is not None:
+        probes.cancel()
+    for task in [*_repos_inflight.values(), *_repos_enriching.values()]:
+        task.cancel()
+    if GITHUB_CACHE_SNAPSHOT:
+        try:
+            _write_repos_snapshot(GITHUB_CACHE_SNAPSHOT)
+        except OSError as e:
+            logger.warning("Error writing repo snapshot %s: %s", GITHUB_CACHE_SNAPSHOT, e)
+    await close_http_clients()
+    if _repos_backend is not None:
+        await _repos_backend.close()
+
+
+app = FastAPI(title="Per4ex API", lifespan=lifespan)
 
 # Configure CORS
 origins = [
@@ -27,6 +140,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Metrics served at /metrics; scraping requires METRICS_TOKEN when it is set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+_metrics = Registry()
+_http_duration = _metrics.histogram(
+    "http_request_duration_seconds", "Time to complete a response, by route template",
+    labels=("method", "route", "status"),
+)
+_repos_lookups = _metrics.counter(
+    "github_repos_cache_lookups_total",
+    "Repo list lookups: hit (fresh), stale (served while refreshing) or miss",
+    labels=("result",),
+)
+_repos_backend_hits = _metrics.counter(
+    "github_repos_cache_backend_hits_total", "Lookups answered by the persistent cache tier"
+)
+_repos_snapshot_hits = _metrics.counter(
+    "github_repos_cache_snapshot_hits_total", "Lookups answered from the startup snapshot"
+)
+_github_request_duration = _metrics.histogram(
+    "github_request_duration_seconds", "Latency of single GitHub API requests", labels=("status",)
+)
+_github_fetch_errors = _metrics.counter(
+    "github_fetch_errors_total", "Repo list refreshes that failed", labels=("reason",)
+)
+_github_truncated = _metrics.counter(
+    "github_repos_truncated_total", "Repo list fetches cut off at GITHUB_MAX_PAGES"
+)
+_chat_ttfb = _metrics.histogram("chat_ttfb_seconds", "Time from stream start to its first event")
+_chat_stream_duration = _metrics.histogram(
+    "chat_stream_duration_seconds", "Chat stream lifetime", labels=("outcome",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0),
+)
+_chat_bytes = _metrics.counter("chat_relayed_bytes_total", "Bytes of events relayed to chat clients")
+_chat_open_streams = _metrics.gauge("chat_open_streams", "Chat streams currently open to clients")
+_chat_spans = _metrics.histogram(
+    "chat_span_seconds", "Upstream chat phases: queue, connect, ttfb and stream", labels=("span",),
+)
+app.add_middleware(RouteTimingMiddleware, histogram=_http_duration)
+
+# Every request gets an X-Request-Id (kept from the caller when present) that
+# is forwarded to Catalyst. PROFILE_SAMPLE_RATE of requests are run under
+# cProfile and dumped to PROFILE_DIR; the rate can also be changed at runtime.
+_profiler = ProfileSampler(
+    rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    directory=os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")),
+)
+app.add_middleware(RequestIdMiddleware, sampler=_profiler)
+
 class Repo(BaseModel):
     name: str
     description: Optional[str] = None
@@ -34,96 +195,1440 @@ class Repo(BaseModel):
     language: Optional[str] = None
     stargazers_count: int
     updated_at: str
+    pushed_at: Optional[str] = None
+    topics: List[str] = []
+    forks_count: int = 0
+    open_issues_count: int = 0
+    # Bytes of code per language; filled in by the enrichment stage
+    languages: Optional[Dict[str, int]] = None
 
 class RepoResponse(BaseModel):
     user: str
     repos: List[Repo]
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+
+class UserRepos(BaseModel):
+    user: str
+    status: Literal["ok", "not_found", "rate_limited", "error"]
+    repos: List[Repo] = []
+    total: int = 0
+    error: Optional[str] = None
+
+class BatchRepoResponse(BaseModel):
+    results: List[UserRepos]
+
+# Bounded in-memory cache with stale-while-revalidate: entries younger than
+# CACHE_TTL are fresh, entries up to CACHE_HARD_TTL are served stale while a
+# single background refresh runs. Older entries are refetched before serving
+# but stay in the LRU, as the last known data if GitHub fails, until evicted.
+CACHE_TTL = int(os.getenv("GITHUB_CACHE_TTL", "3600"))  # 1 hour
+CACHE_HARD_TTL = int(os.getenv("GITHUB_CACHE_HARD_TTL", "86400"))  # 1 day
+_repos_cache = TTLCache(
+    max_entries=int(os.getenv("GITHUB_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(os.getenv("GITHUB_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+)
+_repos_inflight: Dict[str, "asyncio.Task"] = {}
+_repos_enriching: Dict[str, "asyncio.Task"] = {}
+
+
+# Sort orders served from the pre-sorted index: name -> (key, descending)
+REPO_SORTS = {
+    "updated": (lambda r: r.updated_at, True),
+    "stars": (lambda r: r.stargazers_count, True),
+    "name": (lambda r: r.name.casefold(), False),
+}
+RepoSort = Literal["updated", "stars", "name"]
+
+
+@dataclass
+class RepoCacheEntry:
+    user: str
+    repos: List[Repo]  # most recently updated first
+    fetched_at: float
+    # (ETag, Last-Modified) per fetched page, for conditional requests
+    validators: List[Tuple[Optional[str], Optional[str]]] = field(default_factory=list)
+    index: Dict[str, List[Repo]] = field(default_factory=dict, repr=False)
+
+    version: str = field(default="", init=False)
+    # Final response body of the unfiltered listing, keyed by content-coding
+    bodies: Dict[str, bytes] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        for name, (key, descending) in REPO_SORTS.items():
+            self.index[name] = sorted(self.repos, key=key, reverse=descending)
+        # Content hash, used as the strong ETag of our own responses
+        payload = json.dumps([r.model_dump() for r in self.repos], sort_keys=True).encode()
+        self.version = hashlib.blake2b(payload, digest_size=12).hexdigest()
+
+        # Encode and compress once here so cache hits are just a bytes copy
+        body = RepoResponse(user=self.user, repos=self.repos, total=len(self.repos)).model_dump_json().encode()
+        self.bodies["identity"] = body
+        self.bodies["gzip"] = gzip.compress(body, compresslevel=6, mtime=0)
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=9)
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({
+            "user": self.user,
+            "repos": [r.model_dump() for r in self.repos],
+            "fetched_at": self.fetched_at,
+            "validators": self.validators,
+        }).encode()
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "RepoCacheEntry":
+        payload = json.loads(raw)
+        return cls(
+            user=payload["user"],
+            repos=[Repo(**r) for r in payload["repos"]],
+            fetched_at=payload["fetched_at"],
+            validators=[tuple(v) for v in payload["validators"]],
+        )
+
+
+# Optional shared second tier (CACHE_BACKEND_URL=sqlite:///path.db, redis://host:6379/0,
+# memory://) so cached repos survive cold starts and are shared between workers.
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "")
+_repos_backend: Optional[CacheBackend] = backend_from_url(CACHE_BACKEND_URL) if CACHE_BACKEND_URL else None
+
+
+async def _load_persisted_repos(user: str) -> Optional[RepoCacheEntry]:
+    if _repos_backend is None:
+        return None
+    try:
+        raw = await _repos_backend.get(f"github:repos:{user}")
+        if raw is None:
+            return None
+        entry = RepoCacheEntry.from_bytes(raw)
+    except Exception as e:
+        logger.warning("Error reading cached repos for %s: %s", user, e)
+        return None
+    remaining = CACHE_HARD_TTL - (time.time() - entry.fetched_at)
+    if remaining <= 0:
+        return None
+    _repos_cache.set(user, entry)
+    return entry
+
+
+# Snapshot of the in-memory repo cache (JSON lines), written on shutdown and
+# read back lazily on the first cache miss of a new process. Snapshot entries
+# are served whatever their age and, like any cached entry, refreshed in the
+# background once they are older than the refresh interval, so a snapshot
+# bundled with a deployment keeps cold starts off GitHub. Every worker writes
+# the same file on shutdown, so each one merges into what is already there.
+GITHUB_CACHE_SNAPSHOT = os.getenv("GITHUB_CACHE_SNAPSHOT", "")
+_repos_snapshot: Optional[Dict[str, bytes]] = None
+
+
+def _read_repos_snapshot(path: str) -> Dict[str, Tuple[float, bytes]]:
+    """Map each user in the snapshot to its ``(fetched_at, line)``, newest first wins."""
+    entries: Dict[str, Tuple[float, bytes]] = {}
+    skipped = 0
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+                user, fetched_at = data["user"], float(data["fetched_at"])
+            except (ValueError, KeyError, TypeError):
+                skipped += 1
+                continue
+            if user not in entries or fetched_at > entries[user][0]:
+                entries[user] = (fetched_at, line)
+    if skipped:
+        logger.warning("Skipped %d unreadable lines in repo snapshot %s", skipped, path)
+    return entries
+
+
+def _write_repos_snapshot(path: str):
+    try:
+        entries = _read_repos_snapshot(path)
+    except FileNotFoundError:
+        entries = {}
+    for user, entry in _repos_cache.items():
+        if user not in entries or entry.fetched_at >= entries[user][0]:
+            entries[user] = (entry.fetched_at, entry.to_bytes())
+    # A temp file of our own, so workers shutting down together don't write into each other's
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".repos-snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for _, line in entries.values():
+                f.write(line + b"\n")
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _load_snapshot_repos(user: str) -> Optional[RepoCacheEntry]:
+    global _repos_snapshot
+    if not GITHUB_CACHE_SNAPSHOT:
+        return None
+    if _repos_snapshot is None:
+        _repos_snapshot = {}
+        try:
+            entries = _read_repos_snapshot(GITHUB_CACHE_SNAPSHOT)
+            _repos_snapshot = {name: line for name, (_, line) in entries.items()}
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Error reading repo snapshot %s: %s", GITHUB_CACHE_SNAPSHOT, e)
+    # Each user is taken from the snapshot at most once; after that the cache owns it
+    raw = _repos_snapshot.pop(user, None)
+    if raw is None:
+        return None
+    entry = RepoCacheEntry.from_bytes(raw)
+    _repos_cache.set(user, entry)
+    return entry
+
+
+async def _persist_repos(entry: RepoCacheEntry):
+    if _repos_backend is None:
+        return
+    try:
+        await _repos_backend.set(f"github:repos:{entry.user}", entry.to_bytes(), ttl=CACHE_HARD_TTL)
+    except Exception as e:
+        logger.warning("Error persisting repos for %s: %s", entry.user, e)
+
 
-# Simple in-memory cache
-CACHE_TTL = 3600  # 1 hour
-_repos_cache: Dict[str, Any] = {}
+# GitHub API access. A token raises the rate limit from 60 to 5000 requests/hour.
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "")
+GITHUB_PAGE_SIZE = 100
+GITHUB_MAX_PAGES = int(os.getenv("GITHUB_MAX_PAGES", "10"))
+GITHUB_FETCH_CONCURRENCY = int(os.getenv("GITHUB_FETCH_CONCURRENCY", "4"))
+# Per-repo enrichment (language breakdown), only redone for repos that changed
+GITHUB_ENRICH = os.getenv("GITHUB_ENRICH", "1") == "1"
+GITHUB_ENRICH_CONCURRENCY = int(os.getenv("GITHUB_ENRICH_CONCURRENCY", "4"))
+GITHUB_ENRICH_MAX_PER_REFRESH = int(os.getenv("GITHUB_ENRICH_MAX_PER_REFRESH", "30"))
+# Until GitHub has reported a rate limit, assume the unauthenticated 60/hour one
+GITHUB_ENRICH_MAX_UNKNOWN_RATE = int(os.getenv("GITHUB_ENRICH_MAX_UNKNOWN_RATE", "5"))
+# Batch requests (?users=a,b,c)
+GITHUB_BATCH_MAX_USERS = int(os.getenv("GITHUB_BATCH_MAX_USERS", "10"))
+GITHUB_BATCH_CONCURRENCY = int(os.getenv("GITHUB_BATCH_CONCURRENCY", "4"))
+# Once less than this fraction of the hourly budget is left, refresh intervals
+# are stretched proportionally (up to GITHUB_MAX_TTL_STRETCH times CACHE_TTL).
+GITHUB_RATE_LOW_WATERMARK = float(os.getenv("GITHUB_RATE_LOW_WATERMARK", "0.5"))
+GITHUB_MAX_TTL_STRETCH = float(os.getenv("GITHUB_MAX_TTL_STRETCH", "12"))
+# Last rate limit state reported by GitHub
+_github_rate: Dict[str, Optional[float]] = {"limit": None, "remaining": None, "reset": None}
+
+
+class GitHubRateLimited(Exception):
+    pass
+
+
+def _record_rate_limit(resp: httpx.Response):
+    for key in ("limit", "remaining", "reset"):
+        value = resp.headers.get(f"x-ratelimit-{key}")
+        if value is not None:
+            try:
+                _github_rate[key] = float(value)
+            except ValueError:
+                pass
+
+
+def _rate_budget_exhausted(now: float) -> bool:
+    remaining, reset = _github_rate["remaining"], _github_rate["reset"]
+    return remaining is not None and remaining <= 0 and reset is not None and now < reset
+
+
+def _refresh_interval(now: float) -> float:
+    # How long an entry stays fresh, stretched as the GitHub budget runs low
+    limit, remaining, reset = _github_rate["limit"], _github_rate["remaining"], _github_rate["reset"]
+    if not limit or remaining is None:
+        return CACHE_TTL
+    if _rate_budget_exhausted(now):
+        # Nothing left: don't even try until the window resets
+        return max(CACHE_TTL, reset - now)
+    fraction = remaining / limit
+    if fraction >= GITHUB_RATE_LOW_WATERMARK:
+        return CACHE_TTL
+    stretch = min(GITHUB_RATE_LOW_WATERMARK / max(fraction, 1e-9), GITHUB_MAX_TTL_STRETCH)
+    return CACHE_TTL * stretch
 
 # Catalyst Configuration
 CATALYST_BASE_URL = os.getenv("CATALYST_BASE_URL", "http://localhost:8001/v1")
+# Comma-separated list of Catalyst instances; overrides CATALYST_BASE_URL
+CATALYST_BASE_URLS = [
+    url.strip() for url in (os.getenv("CATALYST_BASE_URLS") or CATALYST_BASE_URL).split(",") if url.strip()
+]
 CATALYST_API_KEY = os.getenv("CATALYST_API_KEY", "")
 CATALYST_TENANT_ID = os.getenv("CATALYST_TENANT_ID", "default")
+# Separate budgets for connecting, for the first byte of the answer and for
+# silence between events, instead of one 60s timeout for everything.
+CATALYST_CONNECT_TIMEOUT = float(os.getenv("CATALYST_CONNECT_TIMEOUT", "3"))
+CATALYST_FIRST_BYTE_TIMEOUT = float(os.getenv("CATALYST_FIRST_BYTE_TIMEOUT", "20"))
+CATALYST_READ_TIMEOUT = float(os.getenv("CATALYST_READ_TIMEOUT", "60"))
+CATALYST_TIMEOUT = httpx.Timeout(
+    connect=CATALYST_CONNECT_TIMEOUT,
+    read=CATALYST_READ_TIMEOUT,
+    write=CATALYST_CONNECT_TIMEOUT,
+    pool=CATALYST_CONNECT_TIMEOUT,
+)
+# Circuit breaker per instance: stop calling one for a while once too many
+# recent calls failed or were slow to produce their first byte.
+def _new_catalyst_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        failure_rate=float(os.getenv("CATALYST_BREAKER_FAILURE_RATE", "0.5")),
+        slow_call_seconds=float(os.getenv("CATALYST_BREAKER_SLOW_SECONDS", "10")),
+        slow_call_rate=float(os.getenv("CATALYST_BREAKER_SLOW_RATE", "0.8")),
+        window=int(os.getenv("CATALYST_BREAKER_WINDOW", "20")),
+        min_calls=int(os.getenv("CATALYST_BREAKER_MIN_CALLS", "5")),
+        open_seconds=float(os.getenv("CATALYST_BREAKER_OPEN_SECONDS", "30")),
+    )
+# New streams go to the instance with the fewest open ones; sessions stick to
+# their instance. With several instances, each is probed every
+# CATALYST_HEALTH_INTERVAL seconds and ejected while its probes fail.
+CATALYST_HEALTH_PATH = os.getenv("CATALYST_HEALTH_PATH", "/health")
+CATALYST_HEALTH_INTERVAL = float(os.getenv("CATALYST_HEALTH_INTERVAL", "10"))
+_catalyst_upstreams = UpstreamPool(
+    CATALYST_BASE_URLS,
+    breaker_factory=_new_catalyst_breaker,
+    unhealthy_after=int(os.getenv("CATALYST_HEALTH_FAILURES", "2")),
+    healthy_after=int(os.getenv("CATALYST_HEALTH_SUCCESSES", "2")),
+    affinity_ttl=float(os.getenv("CATALYST_AFFINITY_TTL", "1800")),
+)
+# Admission control for /api/chat: token buckets per session and per client
+# IP (requests per minute, with bursts), and a cap on concurrent streams with
+# a short wait queue. Rejected requests get 429 with Retry-After.
+CHAT_SESSION_RATE_PER_MIN = float(os.getenv("CHAT_SESSION_RATE_PER_MIN", "20"))
+CHAT_SESSION_BURST = float(os.getenv("CHAT_SESSION_BURST", "5"))
+CHAT_IP_RATE_PER_MIN = float(os.getenv("CHAT_IP_RATE_PER_MIN", "60"))
+CHAT_IP_BURST = float(os.getenv("CHAT_IP_BURST", "10"))
+CHAT_MAX_CONCURRENT = int(os.getenv("CHAT_MAX_CONCURRENT", "64"))
+CHAT_MAX_QUEUED = int(os.getenv("CHAT_MAX_QUEUED", "32"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "2"))
+# Turns one /ws/chat connection may have streaming at the same time
+CHAT_WS_MAX_TURNS = int(os.getenv("CHAT_WS_MAX_TURNS", "4"))
+# Reverse proxies (comma-separated IPs or CIDRs) whose X-Forwarded-For /
+# X-Real-IP is believed. Clients can send those headers themselves, so by
+# default they are ignored and the peer address is used.
+CHAT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in os.getenv("CHAT_TRUSTED_PROXIES", "").split(",") if p.strip()
+]
+_chat_session_limiter = RateLimiter(CHAT_SESSION_RATE_PER_MIN / 60, CHAT_SESSION_BURST)
+_chat_ip_limiter = RateLimiter(CHAT_IP_RATE_PER_MIN / 60, CHAT_IP_BURST)
+_chat_streams = ConcurrencyLimiter(CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUED, CHAT_QUEUE_TIMEOUT)
+# Send an SSE comment after this many seconds of upstream silence, and pause
+# upstream reads once this many complete events are waiting on a slow client.
+CHAT_HEARTBEAT_INTERVAL = float(os.getenv("CHAT_HEARTBEAT_INTERVAL", "15"))
+CHAT_STREAM_BUFFER_EVENTS = int(os.getenv("CHAT_STREAM_BUFFER_EVENTS", "64"))
+
+# Identical session-less questions asked while one is already streaming share
+# that upstream stream instead of starting another generation.
+CHAT_COALESCE_ENABLED = os.getenv("CHAT_COALESCE_ENABLED", "1") == "1"
+_chat_inflight: Dict[str, Broadcast] = {}
+
+# Opt-in cache of complete answers to session-less questions, replayed as SSE.
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "0") == "1"
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "86400"))
+CHAT_CACHE_MAX_BYTES = int(os.getenv("CHAT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# Replay with the original pauses between events instead of all at once
+CHAT_CACHE_REPLAY_TIMING = os.getenv("CHAT_CACHE_REPLAY_TIMING", "0") == "1"
+_chat_cache = TTLCache(
+    max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=CHAT_CACHE_MAX_BYTES,
+    ttl=CHAT_CACHE_TTL,
+    sizeof=lambda events: sum(len(e) + 64 for _, e in events),
+)
+# Bearer token for maintenance endpoints; they are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Upstream prompt assembly: relevant KB sections plus recent history, within
+# CHAT_CONTEXT_TOKENS. KB sections may use up to CHAT_KB_TOKEN_SHARE of it.
+CATALYST_NAMESPACE = os.getenv("CATALYST_NAMESPACE", "per4ex-kb")
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "2000"))
+CHAT_KB_TOKEN_SHARE = float(os.getenv("CHAT_KB_TOKEN_SHARE", "0.6"))
+CHAT_KB_MAX_CHUNKS = int(os.getenv("CHAT_KB_MAX_CHUNKS", "4"))
+
+# Knowledge base served by /api/kb/search, reindexed when the file changes
+KB_PATH = os.getenv(
+    "KB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web", "public", "per4ex_knowledge_base.md"),
+)
+
+# Totals for finished chat streams. Savings from early cancellation are
+# estimated against the average completed stream.
+_chat_stats: Dict[str, float] = {
+    "completed": 0,
+    "completed_bytes": 0,
+    "completed_seconds": 0.0,
+    "cancelled": 0,
+    "cancelled_bytes_saved": 0,
+    "cancelled_seconds_saved": 0.0,
+    "coalesced": 0,
+}
 
 @app.get("/health")
 def health_check():
     return {"status": "ok", "service": "per4ex-api"}
 
-@app.get("/api/github/repos", response_model=RepoResponse)
-async def get_github_repos(user: str = "ppilafas"):
-    current_time = time.time()
-    
-    # Check cache
-    if user in _repos_cache:
-        timestamp, data = _repos_cache[user]
-        if current_time - timestamp < CACHE_TTL:
-            return data
-
-    url = f"https://api.github.com/users/{user}/repos"
-    async with httpx.AsyncClient() as client:
+def _last_page(resp: httpx.Response) -> Optional[int]:
+    last = resp.links.get("last")
+    if not last:
+        return None
+    try:
+        return int(httpx.URL(last["url"]).params.get("page", "1"))
+    except ValueError:
+        return None
+
+
+def _parse_repo(r: Dict[str, Any]) -> Repo:
+    return Repo(
+        name=r.get("name", ""),
+        description=r.get("description"),
+        html_url=r.get("html_url", ""),
+        language=r.get("language"),
+        stargazers_count=r.get("stargazers_count", 0),
+        updated_at=r.get("updated_at", ""),
+        pushed_at=r.get("pushed_at"),
+        topics=r.get("topics") or [],
+        forks_count=r.get("forks_count", 0),
+        open_issues_count=r.get("open_issues_count", 0),
+    )
+
+
+def _github_headers() -> Dict[str, str]:
+    headers = {"Accept": "application/vnd.github+json"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+    return headers
+
+
+def _enrich_budget() -> int:
+    # Don't spend the rate limit on extras once it's running low
+    limit, remaining = _github_rate["limit"], _github_rate["remaining"]
+    if not limit or remaining is None:
+        return min(GITHUB_ENRICH_MAX_PER_REFRESH, GITHUB_ENRICH_MAX_UNKNOWN_RATE)
+    spare = int(remaining - limit * GITHUB_RATE_LOW_WATERMARK)
+    return max(0, min(GITHUB_ENRICH_MAX_PER_REFRESH, spare))
+
+
+def _reuse_enrichment(repos: List[Repo], previous: List[Repo]) -> List[Repo]:
+    """Copy per-repo details over from ``previous`` for repos that haven't changed.
+
+    Returns the repos still missing them.
+    """
+    known = {r.name: r for r in previous if r.languages is not None}
+    pending = []
+    for repo in repos:
+        old = known.get(repo.name)
+        if old is not None and (old.updated_at, old.pushed_at) == (repo.updated_at, repo.pushed_at):
+            repo.languages = old.languages
+        elif repo.languages is None:
+            pending.append(repo)
+    return pending
+
+
+async def _enrich_repos(user: str, repos: List[Repo], previous: List[Repo]) -> int:
+    """Fill in per-repo details, reusing previous results for unchanged repos.
+
+    Returns the number of repos that were (re-)enriched from upstream.
+    """
+    pending = _reuse_enrichment(repos, previous)
+    if not GITHUB_ENRICH or not pending:
+        return 0
+
+    # Most recently updated first; anything over budget is picked up next refresh
+    pending = pending[:_enrich_budget()]
+    client = get_http_client("github")
+    headers = _github_headers()
+    semaphore = asyncio.Semaphore(GITHUB_ENRICH_CONCURRENCY)
+
+    async def enrich(repo: Repo) -> bool:
+        url = f"{GITHUB_API_URL}/repos/{user}/{repo.name}/languages"
         try:
-            resp = await client.get(url, params={"sort": "updated", "per_page": 100}, timeout=10.0)
+            async with semaphore:
+                resp = await client.get(url, headers=headers, timeout=10.0)
+            _record_rate_limit(resp)
             resp.raise_for_status()
-            repos_data = resp.json()
+            languages = resp.json()
         except Exception as e:
-            # If cache exists but expired, return it as fallback
-            if user in _repos_cache:
-                return _repos_cache[user][1]
-            print(f"Error fetching repos: {e}")
-            return {"user": user, "repos": []}
+            logger.warning("Error enriching %s/%s: %s", user, repo.name, e)
+            return False
+        if not isinstance(languages, dict):
+            return False
+        repo.languages = languages
+        return True
+
+    return sum(await asyncio.gather(*(enrich(r) for r in pending)))
+
+
+async def _enrich_cached_repos(user: str) -> None:
+    """Enrich the cached listing of ``user`` and swap in the enriched entry.
+
+    Runs after the listing has been served, so enrichment never delays a
+    response. If the listing is refetched meanwhile, the results are carried
+    over to the new one.
+    """
+    carried: List[Repo] = []
+    while True:
+        entry = _repos_cache.peek(user)
+        if entry is None or all(r.languages is not None for r in entry.repos):
+            return
+        repos = [r.model_copy() for r in entry.repos]
+        await _enrich_repos(user, repos, entry.repos + carried)
+        if _repos_cache.peek(user) is entry:
+            break
+        carried = repos
+    if repos != entry.repos:
+        entry = RepoCacheEntry(user=user, repos=repos, fetched_at=entry.fetched_at, validators=entry.validators)
+        _repos_cache.set(user, entry)
+        await _persist_repos(entry)
+
+
+def _start_enrich(user: str) -> None:
+    # Single-flight, like refreshes: one enrichment per user at a time
+    if not GITHUB_ENRICH or user in _repos_enriching:
+        return
+    task = asyncio.create_task(_enrich_cached_repos(user))
+    _repos_enriching[user] = task
+
+    def _done(t: "asyncio.Task"):
+        if _repos_enriching.get(user) is t:
+            del _repos_enriching[user]
+        if not t.cancelled() and t.exception() is not None:
+            logger.warning("Error enriching repos for %s: %s", user, t.exception())
+
+    task.add_done_callback(_done)
+
+
+async def _fetch_repos(user: str, cached: Optional[RepoCacheEntry] = None) -> RepoCacheEntry:
+    if _rate_budget_exhausted(time.time()):
+        raise GitHubRateLimited(f"GitHub rate limit exhausted until {_github_rate['reset']:.0f}")
+
+    url = f"{GITHUB_API_URL}/users/{user}/repos"
+    base_headers = _github_headers()
+    client = get_http_client("github")
+    validators = cached.validators if cached is not None else []
+    semaphore = asyncio.Semaphore(GITHUB_FETCH_CONCURRENCY)
+
+    async def fetch_page(page: int, conditional: bool = True) -> httpx.Response:
+        headers = dict(base_headers)
+        if conditional and page <= len(validators):
+            etag, last_modified = validators[page - 1]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        params = {"sort": "updated", "per_page": GITHUB_PAGE_SIZE, "page": page}
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                resp = await client.get(url, params=params, headers=headers, timeout=10.0)
+            except httpx.HTTPError:
+                _github_request_duration.labels("error").observe(time.perf_counter() - started)
+                raise
+            _github_request_duration.labels(str(resp.status_code)).observe(time.perf_counter() - started)
+        _record_rate_limit(resp)
+        if resp.status_code != 304:
+            resp.raise_for_status()
+        return resp
+
+    # The first page tells us how many pages there are, the rest go out concurrently
+    first = await fetch_page(1)
+    last = _last_page(first) or (len(validators) if first.status_code == 304 else 1)
+    if last > GITHUB_MAX_PAGES:
+        _github_truncated.inc()
+        logger.warning(
+            "%s has %d pages of repos; only the first %d (GITHUB_MAX_PAGES) are fetched",
+            user, last, GITHUB_MAX_PAGES,
+        )
+    last = max(1, min(last, GITHUB_MAX_PAGES))
+    responses = [first] + list(await asyncio.gather(*(fetch_page(p) for p in range(2, last + 1))))
+
+    if cached is not None and last == len(validators) and all(r.status_code == 304 for r in responses):
+        # Unchanged upstream: keep the parsed data, just restart its clock
+        cached.fetched_at = time.time()
+        _repos_cache.set(user, cached)
+        await _persist_repos(cached)
+        # Some repos may still need details an earlier refresh had no budget for
+        _start_enrich(user)
+        return cached
+
+    # Something changed: pages that came back 304 have to be downloaded in full
+    stale_pages = [i for i, r in enumerate(responses) if r.status_code == 304]
+    refetched = await asyncio.gather(*(fetch_page(i + 1, conditional=False) for i in stale_pages))
+    for i, resp in zip(stale_pages, refetched):
+        responses[i] = resp
 
     # Filter/Transform
     repos = []
-    for r in repos_data:
-        repos.append(Repo(
-            name=r.get("name", ""),
-            description=r.get("description"),
-            html_url=r.get("html_url", ""),
-            language=r.get("language"),
-            stargazers_count=r.get("stargazers_count", 0),
-            updated_at=r.get("updated_at", "")
-        ))
-    
+    seen = set()
+    for resp in responses:
+        for r in resp.json():
+            # Pages can overlap if a repo is updated between requests
+            if r.get("name") in seen:
+                continue
+            seen.add(r.get("name"))
+            repos.append(_parse_repo(r))
+
     # Sort locally just in case
     repos.sort(key=lambda x: x.updated_at, reverse=True)
-    
-    result = {"user": user, "repos": repos}
-    _repos_cache[user] = (current_time, result)
-    
+
+    _reuse_enrichment(repos, cached.repos if cached is not None else [])
+
+    entry = RepoCacheEntry(
+        user=user,
+        repos=repos,
+        fetched_at=time.time(),
+        validators=[(r.headers.get("etag"), r.headers.get("last-modified")) for r in responses],
+    )
+    _repos_cache.set(user, entry)
+    await _persist_repos(entry)
+    _start_enrich(user)
+    return entry
+
+
+def _query_repos(
+    entry: RepoCacheEntry,
+    language: Optional[str] = None,
+    min_stars: Optional[int] = None,
+    sort: RepoSort = "updated",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    repos = entry.index[sort]
+    if language is not None:
+        wanted = language.casefold()
+        repos = [r for r in repos if (r.language or "").casefold() == wanted]
+    if min_stars is not None:
+        repos = [r for r in repos if r.stargazers_count >= min_stars]
+
+    # Cursors are offsets into the filtered, sorted listing
+    try:
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    end = len(repos) if limit is None else offset + limit
+    return {
+        "user": entry.user,
+        "repos": repos[offset:end],
+        "total": len(repos),
+        "next_cursor": str(end) if end < len(repos) else None,
+    }
+
+
+def _start_refresh(user: str, cached: Optional[RepoCacheEntry] = None) -> "asyncio.Task":
+    # Single-flight: every caller for the same user shares one in-flight fetch.
+    task = _repos_inflight.get(user)
+    if task is None:
+        task = asyncio.create_task(_fetch_repos(user, cached))
+        _repos_inflight[user] = task
+
+        def _done(t: "asyncio.Task"):
+            if _repos_inflight.get(user) is t:
+                del _repos_inflight[user]
+            if not t.cancelled() and t.exception() is not None:
+                _github_fetch_errors.labels(_fetch_error_status(t.exception())).inc()
+                logger.warning("Error fetching repos for %s: %s", user, t.exception())
+
+        task.add_done_callback(_done)
+    return task
+
+
+async def _get_repos_entry(user: str) -> RepoCacheEntry:
+    entry = _repos_cache.get(user)
+    from_snapshot = False
+    if entry is None:
+        # Another worker or an earlier process may already have it
+        entry = await _load_persisted_repos(user)
+        if entry is not None:
+            _repos_backend_hits.inc()
+        else:
+            entry = _load_snapshot_repos(user)
+            if entry is not None:
+                _repos_snapshot_hits.inc()
+                from_snapshot = True
+    if entry is not None:
+        now = time.time()
+        age = now - entry.fetched_at
+        if age < CACHE_HARD_TTL or from_snapshot:
+            if age >= _refresh_interval(now):
+                # Serve stale immediately, refresh in the background
+                _repos_lookups.labels("stale").inc()
+                _start_refresh(user, entry)
+            else:
+                _repos_lookups.labels("hit").inc()
+            return entry
+
+    _repos_lookups.labels("miss").inc()
+    try:
+        # Shield so a disconnecting caller doesn't cancel the fetch for everyone else
+        return await asyncio.shield(_start_refresh(user, entry))
+    except Exception:
+        # If cache exists but expired, return it as fallback
+        if entry is not None:
+            return entry
+        raise
+
+
+def _cache_headers(entry: RepoCacheEntry, etag: str) -> Dict[str, str]:
+    # Let browsers and the CDN keep the response exactly as long as we would
+    now = time.time()
+    age = now - entry.fetched_at
+    fresh_for = max(0, int(_refresh_interval(now) - age))
+    stale_for = max(0, int(CACHE_HARD_TTL - age) - fresh_for)
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={fresh_for}, s-maxage={fresh_for}, stale-while-revalidate={stale_for}",
+    }
+
+
+def _etag_matches(if_none_match: Optional[str], *etags: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") in etags for tag in if_none_match.split(","))
+
+
+def _negotiate_encoding(accept_encoding: str, available: Dict[str, bytes]) -> str:
+    # Pick the variant the client rates highest; br > gzip > identity breaks ties
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    preference = {"br": 2, "gzip": 1, "identity": 0}
+    candidates = [
+        (accepted.get(coding, accepted.get("*", 1.0 if coding == "identity" else 0.0)), preference[coding], coding)
+        for coding in available if coding in preference
+    ]
+    q, _, coding = max(candidates, default=(0.0, 0, "identity"))
+    # Identity is always available, even if the client rated everything at zero
+    return coding if q > 0 else "identity"
+
+
+def _entry_etag(entry: RepoCacheEntry, encoding: str) -> str:
+    return f'"{entry.version}"' if encoding == "identity" else f'"{entry.version}-{encoding}"'
+
+
+def _fetch_error_status(error: Exception) -> str:
+    if isinstance(error, GitHubRateLimited):
+        return "rate_limited"
+    if isinstance(error, httpx.HTTPStatusError):
+        if error.response.status_code == 404:
+            return "not_found"
+        if error.response.status_code in (403, 429) and error.response.headers.get("x-ratelimit-remaining") == "0":
+            return "rate_limited"
+    return "error"
+
+
+async def _get_repos_batch(
+    users: List[str],
+    language: Optional[str],
+    min_stars: Optional[int],
+    sort: RepoSort,
+    limit: Optional[int],
+) -> Dict[str, Any]:
+    # Resolve every user through the cache at once, with bounded upstream fan-out
+    semaphore = asyncio.Semaphore(GITHUB_BATCH_CONCURRENCY)
+
+    async def resolve(user: str) -> Dict[str, Any]:
+        try:
+            async with semaphore:
+                entry = await _get_repos_entry(user)
+        except Exception as e:
+            return {"user": user, "status": _fetch_error_status(e), "error": str(e) or type(e).__name__}
+        result = _query_repos(entry, language, min_stars, sort, limit)
+        return {"user": user, "status": "ok", "repos": result["repos"], "total": result["total"]}
+
+    return {"results": await asyncio.gather(*(resolve(u) for u in users))}
+
+
+@app.get("/api/github/repos", response_model=Union[RepoResponse, BatchRepoResponse])
+async def get_github_repos(
+    request: Request,
+    response: Response,
+    user: str = "ppilafas",
+    users: Optional[str] = None,
+    language: Optional[str] = None,
+    min_stars: Annotated[Optional[int], Query(ge=0)] = None,
+    sort: RepoSort = "updated",
+    limit: Annotated[Optional[int], Query(ge=1, le=100)] = None,
+    cursor: Optional[str] = None,
+):
+    if users is not None:
+        names = list(dict.fromkeys(u.strip() for u in users.split(",") if u.strip()))
+        if not names or len(names) > GITHUB_BATCH_MAX_USERS:
+            raise HTTPException(status_code=400, detail=f"users must list 1 to {GITHUB_BATCH_MAX_USERS} accounts")
+        if cursor is not None:
+            raise HTTPException(status_code=400, detail="cursor is not supported with users")
+        response.headers["Cache-Control"] = "no-cache"
+        return await _get_repos_batch(names, language, min_stars, sort, limit)
+
+    try:
+        entry = await _get_repos_entry(user)
+    except Exception:
+        response.headers["Cache-Control"] = "no-store"
+        return {"user": user, "repos": [], "total": 0}
+
+    query = (language, min_stars, sort, limit, cursor)
+    if query == (None, None, "updated", None, None):
+        # Unfiltered listing: serve the pre-encoded bytes, no validation or serialization
+        encoding = _negotiate_encoding(request.headers.get("accept-encoding", ""), entry.bodies)
+        headers = _cache_headers(entry, _entry_etag(entry, encoding))
+        headers["Vary"] = "Accept-Encoding"
+        variants = [_entry_etag(entry, e) for e in entry.bodies]
+        if _etag_matches(request.headers.get("if-none-match"), *variants):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=entry.bodies[encoding], media_type="application/json", headers=headers)
+
+    result = _query_repos(entry, language, min_stars, sort, limit, cursor)
+
+    # Each distinct query is its own representation of the same data version
+    etag = f'"{entry.version}-{hashlib.blake2b(repr(query).encode(), digest_size=4).hexdigest()}"'
+    headers = _cache_headers(entry, etag)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return result
 
 # Chat Proxy for Catalyst
+class ChatMessage(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
+    # Earlier turns, oldest first; trimmed to the token budget
+    history: List[ChatMessage] = []
 
-@app.post("/api/chat")
-async def proxy_chat(request: ChatRequest):
-    if not CATALYST_API_KEY:
-        raise HTTPException(status_code=503, detail="Catalyst API Key not configured")
+async def _catalyst_events(
+    payload: Dict[str, Any], headers: Dict[str, str], trace: Optional[Trace] = None
+) -> AsyncIterator[bytes]:
+    # Yields complete SSE events from Catalyst, however the bytes were chunked
+    trace = trace or Trace()
+    upstream = _catalyst_upstreams.acquire(payload.get("session_id"))
+    if upstream is None:
+        # Fail fast instead of tying up a worker and a connection on a dead upstream
+        yield error_event("Catalyst is temporarily unavailable")
+        return
+
+    breaker = upstream.breaker
+    client = get_http_client("catalyst")
+    started = time.monotonic()
+    deadline = started + CATALYST_FIRST_BYTE_TIMEOUT
+    request = client.build_request(
+        "POST", f"{upstream.url}/chat/stream", json=payload, headers=headers, timeout=CATALYST_TIMEOUT
+    )
+    resp = None
+    # Whether the breaker has been told how this call went
+    settled = False
+    try:
+        try:
+            resp = await asyncio.wait_for(client.send(request, stream=True), CATALYST_FIRST_BYTE_TIMEOUT)
+            trace.mark("connect")
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            breaker.record_failure()
+            settled = True
+            logger.warning("Catalyst request to %s failed: %r", upstream.url, e)
+            yield error_event("Catalyst is unavailable")
+            return
+
+        if resp.status_code != 200:
+            if resp.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success(time.monotonic() - started)
+            settled = True
+            yield error_event(f"Upstream error {resp.status_code}")
+            return
+
+        parser = SSEParser()
+        chunks = resp.aiter_bytes()
+        first_byte = True
+        while True:
+            try:
+                if first_byte:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - time.monotonic()))
+                    trace.mark("ttfb")
+                    breaker.record_success(time.monotonic() - started)
+                    settled = True
+                    first_byte = False
+                else:
+                    chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                logger.warning("Catalyst stream from %s failed: %r", upstream.url, e)
+                if first_byte:
+                    breaker.record_failure()
+                    settled = True
+                    yield error_event("Catalyst did not respond in time")
+                else:
+                    yield error_event("Catalyst stream interrupted")
+                return
+            for event in parser.feed(chunk):
+                yield event
+        tail = parser.flush()
+        if tail:
+            yield tail
+    finally:
+        if not settled:
+            # Cancelled (client gone) or an empty body: don't hold a half-open probe slot
+            breaker.abandon()
+        _catalyst_upstreams.release(upstream)
+        if resp is not None:
+            await resp.aclose()
+        if "ttfb" in trace.spans:
+            trace.mark("stream")
+        for span, seconds in trace.spans.items():
+            _chat_spans.labels(span).observe(seconds)
+        logger.info("Catalyst stream %s via %s: %s", trace.request_id, upstream.url, trace)
+
+
+async def _wait_for_disconnect(http_request: Request):
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def _record_completion(sent_bytes: int, elapsed: float):
+    _chat_stream_duration.labels("completed").observe(elapsed)
+    _chat_bytes.inc(sent_bytes)
+    _chat_stats["completed"] += 1
+    _chat_stats["completed_bytes"] += sent_bytes
+    _chat_stats["completed_seconds"] += elapsed
+
+
+def _record_cancellation(sent_bytes: int, elapsed: float):
+    completed = _chat_stats["completed"]
+    bytes_saved = seconds_saved = 0.0
+    if completed:
+        bytes_saved = max(0.0, _chat_stats["completed_bytes"] / completed - sent_bytes)
+        seconds_saved = max(0.0, _chat_stats["completed_seconds"] / completed - elapsed)
+    _chat_stream_duration.labels("cancelled").observe(elapsed)
+    _chat_bytes.inc(sent_bytes)
+    _chat_stats["cancelled"] += 1
+    _chat_stats["cancelled_bytes_saved"] += int(bytes_saved)
+    _chat_stats["cancelled_seconds_saved"] += seconds_saved
+    logger.info(
+        "Chat client disconnected after %.2fs / %d bytes; closed upstream (~%.2fs / %d bytes saved)",
+        elapsed, sent_bytes, seconds_saved, bytes_saved,
+    )
+
+
+# Upstream closes still running after the request task that started them was cancelled
+_closing_streams: "set[asyncio.Task]" = set()
+
+
+async def _close_stream(stream: AsyncIterator[bytes], pending: Optional["asyncio.Future"]):
+    if pending is not None and not pending.done():
+        pending.cancel()
+        await asyncio.wait({pending})
+    await stream.aclose()
+
+
+async def _stream_until_disconnect(stream: AsyncIterator[bytes], http_request: Request) -> AsyncIterator[bytes]:
+    # Close the upstream stream as soon as the browser goes away instead of
+    # reading it to the end (or until the next write to the dead socket fails).
+    # Servers on ASGI spec < 2.4 also make StreamingResponse watch for the
+    # disconnect and cancel this generator, in which case only the finally runs.
+    started = time.monotonic()
+    sent_bytes = 0
+    first_event_seen = False
+    finished = False
+    disconnected = asyncio.create_task(_wait_for_disconnect(http_request))
+    next_event = None
+    _chat_open_streams.inc()
+    try:
+        while True:
+            next_event = asyncio.ensure_future(stream.__anext__())
+            await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                return
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                finished = True
+                return
+            # Keep-alives are neither the first byte of the answer nor part of it
+            if event != HEARTBEAT:
+                if not first_event_seen:
+                    _chat_ttfb.observe(time.monotonic() - started)
+                    first_event_seen = True
+                sent_bytes += len(event)
+            yield event
+    finally:
+        _chat_open_streams.dec()
+        if finished:
+            _record_completion(sent_bytes, time.monotonic() - started)
+        else:
+            _record_cancellation(sent_bytes, time.monotonic() - started)
+        disconnected.cancel()
+        # Inside a cancelled scope every await is cancelled again, so close the
+        # upstream in a task of its own that finishes even if this one doesn't
+        closing = asyncio.ensure_future(_close_stream(stream, next_event))
+        _closing_streams.add(closing)
+        closing.add_done_callback(_closing_streams.discard)
+        await asyncio.shield(closing)
+
+
+def _question_key(request: ChatRequest) -> Optional[str]:
+    # Only stateless questions are interchangeable between visitors
+    if request.session_id or request.history:
+        return None
+    normalized = " ".join(request.message.casefold().split()).rstrip("?!. ")
+    if not normalized:
+        return None
+    return f"{CATALYST_TENANT_ID}:{normalized}"
+
+
+def _chat_cache_key(request: ChatRequest) -> Optional[str]:
+    return _question_key(request) if CHAT_CACHE_ENABLED else None
+
+
+def _chat_coalesce_key(request: ChatRequest) -> Optional[str]:
+    return _question_key(request) if CHAT_COALESCE_ENABLED else None
+
+
+def _start_flight(key: str, events: AsyncIterator[bytes], release) -> Broadcast:
+    def forget():
+        # Runs as soon as everyone has left, not once upstream has finished
+        # closing, so nobody joins a stream that is being torn down
+        if _chat_inflight.get(key) is flight:
+            del _chat_inflight[key]
+
+    def done():
+        forget()
+        release()
+
+    flight = _chat_inflight[key] = Broadcast(events, on_done=done, on_closing=forget)
+    return flight
+
+
+def invalidate_chat_cache():
+    # Call whenever the knowledge base changes so stale answers aren't replayed
+    _chat_cache.clear()
+
+
+_kb = KnowledgeBase(KB_PATH, on_change=invalidate_chat_cache)
+
+
+class KBChunk(BaseModel):
+    title: str
+    text: str
+    score: float
+
+class KBSearchResponse(BaseModel):
+    query: str
+    results: List[KBChunk]
+
+
+@app.get("/api/kb/search", response_model=KBSearchResponse)
+async def search_kb(q: str, k: Annotated[int, Query(ge=1, le=20)] = 5):
+    results = _kb.search(q, k)
+    return {
+        "query": q,
+        "results": [{"title": c.title, "text": c.text, "score": score} for c, score in results],
+    }
+
+
+async def _record_events(events: AsyncIterator[bytes], key: str) -> AsyncIterator[bytes]:
+    # Pass events through, keeping (offset, event) pairs to store once the answer completes
+    started = time.monotonic()
+    recorded: List[Tuple[float, bytes]] = []
+    size = 0
+    cacheable = True
+    async for event in events:
+        if isinstance(event, ErrorEvent):
+            cacheable = False
+        elif cacheable:
+            size += len(event)
+            # Don't let one huge answer take over the cache
+            cacheable = size <= CHAT_CACHE_MAX_BYTES // 8
+            recorded.append((time.monotonic() - started, bytes(event)))
+        yield event
+    if cacheable and recorded:
+        _chat_cache.set(key, tuple(recorded))
+
+
+async def _replay_events(recorded: Tuple[Tuple[float, bytes], ...]) -> AsyncIterator[bytes]:
+    started = time.monotonic()
+    for offset, event in recorded:
+        if CHAT_CACHE_REPLAY_TIMING:
+            delay = offset - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield event
+
+
+def _build_catalyst_payload(request: ChatRequest) -> Dict[str, Any]:
+    # Token counts of KB chunks are computed at index time; messages use the
+    # same cheap estimate, so no tokenizer runs per request.
+    budget = CHAT_CONTEXT_TOKENS - estimate_tokens(request.message)
+
+    sections = []
+    kb_budget = int(budget * CHAT_KB_TOKEN_SHARE)
+    for chunk, _ in _kb.search(request.message, CHAT_KB_MAX_CHUNKS):
+        if chunk.tokens <= kb_budget:
+            sections.append(chunk.text)
+            kb_budget -= chunk.tokens
+            budget -= chunk.tokens
+
+    # Most recent turns first, as many as fit in what's left
+    history = []
+    for message in reversed(request.history):
+        tokens = estimate_tokens(message.content)
+        if tokens > budget:
+            break
+        history.append({"role": message.role, "content": message.content})
+        budget -= tokens
+    history.reverse()
+
+    content = request.message
+    if sections:
+        context = "\n\n".join(sections)
+        content = f"SYSTEM CONTEXT - KNOWLEDGE BASE:\n{context}\n\nUSER QUESTION:\n{request.message}"
+    return {
+        "messages": history + [{"role": "user", "content": content}],
+        "session_id": request.session_id,
+        "config": {"namespace": CATALYST_NAMESPACE},
+    }
+
+
+def _require_admin(http_request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin token not configured")
+    if http_request.headers.get("authorization") != f"Bearer {ADMIN_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@app.post("/api/chat/cache/invalidate")
+async def invalidate_chat_cache_endpoint(http_request: Request):
+    _require_admin(http_request)
+    entries = len(_chat_cache)
+    invalidate_chat_cache()
+    return {"invalidated": entries}
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in CHAT_TRUSTED_PROXIES)
+
+
+def _client_ip(http_request: HTTPConnection) -> str:
+    peer = http_request.client.host if http_request.client else "unknown"
+    if not _is_trusted_proxy(peer):
+        return peer
+    # Walk back through our own proxies; the first hop they didn't add is the
+    # client. Anything further left was written by the client and can be forged.
+    hops = [h.strip() for h in http_request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return http_request.headers.get("x-real-ip", "").strip() or (hops[0] if hops else peer)
+
+
+def _too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many chat requests",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def _check_chat_rate(request: ChatRequest, http_request: HTTPConnection):
+    # A request refused for its session doesn't also use up its IP's budget
+    wait = _chat_session_limiter.acquire(request.session_id) if request.session_id else 0.0
+    if not wait:
+        wait = _chat_ip_limiter.acquire(_client_ip(http_request))
+    if wait:
+        raise _too_many_requests(wait)
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    # Frees the concurrency slot once the response is over, however it ends
+    # (including a client that leaves before the first byte is sent)
+    def __init__(self, *args, release, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+@app.post("/api/debug/profiling")
+async def set_profiling(http_request: Request, rate: Annotated[float, Query(ge=0, le=1)]):
+    _require_admin(http_request)
+    _profiler.rate = rate
+    return {"rate": _profiler.rate, "directory": _profiler.directory, "dumped": _profiler.dumped}
+
+
+@app.get("/api/chat/upstreams")
+async def chat_upstreams(http_request: Request):
+    _require_admin(http_request)
+    return {"upstreams": _catalyst_upstreams.stats(), "streams": _chat_streams.stats()}
+
+
+@dataclass
+class _ChatTurn:
+    events: AsyncIterator[bytes]
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Frees the concurrency slot; None when the turn doesn't hold one
+    release: Optional[Callable[[], None]] = None
+    trace: Optional[Trace] = None
+    # Served from the answer cache rather than from Catalyst
+    replay: bool = False
+
+
+async def _open_chat_turn(request: ChatRequest, conn: HTTPConnection) -> _ChatTurn:
+    # Shared by the SSE and WebSocket transports. Raises 429 when over a limit.
+    _check_chat_rate(request, conn)
+
+    cache_key = _chat_cache_key(request)
+    if cache_key is not None:
+        recorded = _chat_cache.get(cache_key)
+        if recorded is not None:
+            return _ChatTurn(_replay_events(recorded), {"X-Cache": "HIT"}, replay=True)
+
+    # Join an identical question that is already streaming: replay what it has
+    # sent so far, then follow it live
+    coalesce_key = _chat_coalesce_key(request)
+    flight = _chat_inflight.get(coalesce_key) if coalesce_key is not None else None
+    if flight is not None and not flight.closing:
+        _chat_stats["coalesced"] += 1
+        return _ChatTurn(flight.subscribe(), {"X-Coalesced": "1"})
+
+    payload = _build_catalyst_payload(request)
+    request_id = request_id_var.get() or new_request_id()
+    trace = Trace(request_id)
+    if not await _chat_streams.acquire():
+        raise _too_many_requests(CHAT_QUEUE_TIMEOUT or 1)
+    trace.mark("queue")
 
-    url = f"{CATALYST_BASE_URL}/chat/stream"
     headers = {
         "Authorization": f"Bearer {CATALYST_API_KEY}",
         "X-Tenant-Id": CATALYST_TENANT_ID,
+        "X-Request-Id": request_id,
         "Content-Type": "application/json"
     }
-    
-    # Forward the request to Catalyst
-    # We use StreamingResponse to support SSE if we want to get fancy, 
-    # but for now let's just forward the request and return the stream
-    
-    async def stream_generator():
-        async with httpx.AsyncClient() as client:
-            async with client.stream("POST", url, json=request.model_dump(), headers=headers, timeout=60.0) as resp:
-                if resp.status_code != 200:
-                    yield f"data: {{\"error\": \"Upstream error {resp.status_code}\"}}\n\n"
-                    return
-                    
-                async for chunk in resp.aiter_bytes():
-                    yield chunk
-
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    turn = _ChatTurn(_catalyst_events(payload, headers, trace), release=_chat_streams.release, trace=trace)
+    if cache_key is not None:
+        turn.events = _record_events(turn.events, cache_key)
+        turn.headers["X-Cache"] = "MISS"
+    if coalesce_key is not None:
+        # The shared stream holds the concurrency slot until upstream is done
+        flight = _start_flight(coalesce_key, turn.events, turn.release)
+        turn.events, turn.release = flight.subscribe(), None
+    return turn
+
+
+@app.post("/api/chat")
+async def proxy_chat(request: ChatRequest, http_request: Request):
+    if not CATALYST_API_KEY:
+        raise HTTPException(status_code=503, detail="Catalyst API Key not configured")
+    turn = await _open_chat_turn(request, http_request)
+
+    # X-Accel-Buffering stops nginx-style proxies from holding events back
+    response_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **turn.headers}
+    if turn.trace is not None:
+        response_headers["Server-Timing"] = turn.trace.server_timing()
+    if turn.replay:
+        return StreamingResponse(turn.events, media_type="text/event-stream", headers=response_headers)
+    # Forward events as soon as each one is complete
+    return _sse_response(turn.events, http_request, response_headers, release=turn.release)
+
+
+def _sse_response(
+    events: AsyncIterator[bytes],
+    http_request: Request,
+    headers: Dict[str, str],
+    release: Optional[Callable[[], None]] = None,
+) -> StreamingResponse:
+    stream = relay_events(
+        events,
+        max_buffered=CHAT_STREAM_BUFFER_EVENTS,
+        heartbeat_interval=CHAT_HEARTBEAT_INTERVAL,
+    )
+    body = _stream_until_disconnect(stream, http_request)
+    if release is None:
+        return StreamingResponse(body, media_type="text/event-stream", headers=headers)
+    return _AdmittedStreamingResponse(body, media_type="text/event-stream", headers=headers, release=release)
+
+
+async def _relay_turn_frames(turn_id: str, turn: _ChatTurn, send: Callable[[Dict[str, Any]], Any]):
+    # SSE framing is dropped: each event goes out as one small JSON frame
+    started = time.monotonic()
+    sent_bytes = 0
+    finished = False
+    _chat_open_streams.inc()
+    try:
+        async for event in turn.events:
+            if not sent_bytes:
+                _chat_ttfb.observe(time.monotonic() - started)
+            data = event_data(event)
+            if isinstance(event, ErrorEvent):
+                await send({"id": turn_id, "error": json.loads(data)["error"]})
+            elif data:
+                try:
+                    # Embed JSON payloads as-is rather than as escaped strings
+                    value = json.loads(data)
+                except ValueError:
+                    value = data
+                await send({"id": turn_id, "data": value})
+            sent_bytes += len(event)
+        finished = True
+        await send({"id": turn_id, "done": True})
+    finally:
+        _chat_open_streams.dec()
+        await turn.events.aclose()
+        if turn.release is not None:
+            turn.release()
+        if not turn.replay:
+            if finished:
+                _record_completion(sent_bytes, time.monotonic() - started)
+            else:
+                _record_cancellation(sent_bytes, time.monotonic() - started)
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    # One connection carries any number of turns, each tagged by a client-chosen id:
+    #   -> {"id": "1", "message": "...", "session_id": "...", "history": [...]}
+    #   -> {"id": "1", "cancel": true}
+    #   <- {"id": "1", "data": ...} ... {"id": "1", "done": true}
+    #      ("data" is the event's JSON payload, or its text if it isn't JSON)
+    #   <- {"id": "1", "error": "...", "retry_after": 3} / {"id": "1", "cancelled": true}
+    if not CATALYST_API_KEY:
+        await websocket.close(code=1011, reason="Catalyst API Key not configured")
+        return
+    await websocket.accept()
+    turns: Dict[str, asyncio.Task] = {}
+    send_lock = asyncio.Lock()
+    connection_id = request_id_var.get() or new_request_id()
+    turn_count = 0
+
+    async def send(frame: Dict[str, Any]):
+        async with send_lock:
+            # Turns still streaming when the socket goes away stop here
+            if WebSocketState.DISCONNECTED in (websocket.client_state, websocket.application_state):
+                raise WebSocketDisconnect(1006)
+            await websocket.send_text(json.dumps(frame, separators=(",", ":")))
+
+    async def run_turn(turn_id: str, request: ChatRequest, request_id: str):
+        # Each turn is traced and forwarded upstream under its own id
+        request_id_var.set(request_id)
+        try:
+            try:
+                turn = await _open_chat_turn(request, websocket)
+            except HTTPException as e:
+                frame = {"id": turn_id, "error": e.detail}
+                if e.headers and "Retry-After" in e.headers:
+                    frame["retry_after"] = int(e.headers["Retry-After"])
+                await send(frame)
+                return
+            await _relay_turn_frames(turn_id, turn, send)
+        except WebSocketDisconnect:
+            pass
+        except Exception:
+            logger.exception("Chat turn %s failed", turn_id)
+            try:
+                await send({"id": turn_id, "error": "Chat turn failed"})
+            except WebSocketDisconnect:
+                pass
+        finally:
+            turns.pop(turn_id, None)
+
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+                turn_id = str(frame["id"])
+            except (ValueError, KeyError, TypeError):
+                await send({"error": "Invalid frame"})
+                continue
+
+            if frame.get("cancel"):
+                task = turns.get(turn_id)
+                if task is not None:
+                    task.cancel()
+                    await asyncio.wait({task})
+                    await send({"id": turn_id, "cancelled": True})
+                continue
+            if turn_id in turns:
+                await send({"id": turn_id, "error": "Turn id already in use"})
+                continue
+            if len(turns) >= CHAT_WS_MAX_TURNS:
+                await send({"id": turn_id, "error": "Too many concurrent turns"})
+                continue
+            try:
+                request = ChatRequest.model_validate(frame)
+            except ValidationError:
+                await send({"id": turn_id, "error": "Invalid chat request"})
+                continue
+            turn_count += 1
+            turns[turn_id] = asyncio.create_task(run_turn(turn_id, request, f"{connection_id}.{turn_count}"))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Same rule as the SSE endpoint: nobody listening, close upstream now
+        pending = list(turns.values())
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+
+def _cache_samples(cache: TTLCache) -> List[Tuple[Dict[str, str], float]]:
+    return [({"stat": key}, value) for key, value in cache.stats().items()]
+
+
+def _upstream_samples(field_name: str) -> List[Tuple[Dict[str, str], float]]:
+    # Labelled by position in CATALYST_BASE_URLS: /metrics may be public, the
+    # URLs are only shown to admins at /api/chat/upstreams (in the same order)
+    return [({"upstream": str(i)}, float(u[field_name])) for i, u in enumerate(_catalyst_upstreams.stats())]
+
+
+_metrics.collector("github_repos_cache", "gauge", "In-memory repo cache counters and size",
+                   lambda: _cache_samples(_repos_cache))
+_metrics.collector("chat_answer_cache", "gauge", "Chat answer cache counters and size",
+                   lambda: _cache_samples(_chat_cache))
+_metrics.collector("chat_streams", "gauge", "Totals for finished chat streams",
+                   lambda: [({"stat": key}, value) for key, value in _chat_stats.items()])
+_metrics.collector("chat_admission", "gauge", "Concurrency cap: active, waiting and rejected streams",
+                   lambda: [({"stat": key}, value) for key, value in _chat_streams.stats().items()])
+_metrics.collector("chat_rate_limited_total", "counter", "Chat requests refused by a rate limit",
+                   lambda: [({"key": "session"}, _chat_session_limiter.rejected),
+                            ({"key": "ip"}, _chat_ip_limiter.rejected)])
+_metrics.collector("catalyst_upstream_open_streams", "gauge", "Open streams per Catalyst instance",
+                   lambda: _upstream_samples("active"))
+_metrics.collector("catalyst_upstream_requests_total", "counter", "Streams sent to each Catalyst instance",
+                   lambda: _upstream_samples("requests"))
+_metrics.collector("catalyst_upstream_healthy", "gauge", "1 while a Catalyst instance passes health checks",
+                   lambda: _upstream_samples("healthy"))
+_metrics.collector("catalyst_upstream_breaker_open", "gauge", "1 while an instance's circuit breaker is open",
+                   lambda: [({"upstream": str(i)}, float(u.breaker.state == "open"))
+                            for i, u in enumerate(_catalyst_upstreams.upstreams)])
+
+
+@app.get("/metrics")
+async def metrics(http_request: Request):
+    if METRICS_TOKEN and http_request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(content=_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
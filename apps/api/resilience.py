@@ -0,0 +1,210 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Count-based circuit breaker with failure-rate and slow-call thresholds.
+
+    The last ``window`` calls are tracked. Once at least ``min_calls`` have
+    been seen and either the failure rate or the rate of calls slower than
+    ``slow_call_seconds`` reaches its threshold, the circuit opens and
+    ``allow()`` returns False for ``open_seconds``. After that up to
+    ``half_open_calls`` probe calls are let through: a success closes the
+    circuit again, a failure re-opens it. A probe that ends without either
+    must be handed back with ``abandon()``; probes that haven't reported
+    back after another ``open_seconds`` count as a failure.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate: float = 0.8,
+        window: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        # (failed, slow) per recent call
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probed_at = 0.0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        now = self.clock()
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+        elif self._state == HALF_OPEN and self._probes and now - self._probed_at >= self.open_seconds:
+            self._trip()
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes < self.half_open_calls:
+            self._probes += 1
+            self._probed_at = self.clock()
+            return True
+        self.rejected += 1
+        return False
+
+    def abandon(self) -> None:
+        """Hand back a call let through by ``allow()`` that ended without an outcome."""
+        if self._state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def record_success(self, duration: float = 0.0) -> None:
+        if self._state == HALF_OPEN:
+            if duration >= self.slow_call_seconds:
+                self._trip()
+                return
+            self._state = CLOSED
+            self._calls.clear()
+        self._record(False, duration >= self.slow_call_seconds)
+
+    def record_failure(self) -> None:
+        if self._state == HALF_OPEN:
+            self._trip()
+            return
+        self._record(True, False)
+
+    def _record(self, failed: bool, slow: bool) -> None:
+        self._calls.append((failed, slow))
+        total = len(self._calls)
+        if self._state != CLOSED or total < self.min_calls:
+            return
+        failures = sum(1 for f, _ in self._calls if f)
+        slow_calls = sum(1 for _, s in self._calls if s)
+        if failures / total >= self.failure_rate or slow_calls / total >= self.slow_call_rate:
+            self._trip()
+
+    def _trip(self) -> None:
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._calls.clear()
+
+    def stats(self) -> Dict[str, object]:
+        return {"state": self.state, "recent_calls": len(self._calls), "rejected": self.rejected}
+
+
+class RateLimiter:
+    """Token buckets keyed by client (session id, IP, ...).
+
+    Each key refills at ``rate`` tokens per second up to ``burst``. Only the
+    ``max_keys`` most recently seen keys are tracked; a forgotten key simply
+    starts again with a full bucket.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_keys: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        # key -> (tokens, updated_at)
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+        self.rejected = 0
+
+    def acquire(self, key: Hashable) -> float:
+        """Take a token for ``key``. Returns 0 if allowed, else seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = self.clock()
+        tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.rejected += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def stats(self) -> Dict[str, object]:
+        return {"keys": len(self._buckets), "rejected": self.rejected}
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent work, with a short bounded queue in front of the cap.
+
+    ``acquire`` returns False straight away when ``max_waiting`` callers are
+    already queued, or once ``timeout`` seconds pass without a free slot.
+    Slots are handed to waiters in arrival order.
+    """
+
+    def __init__(self, limit: int, max_waiting: int = 0, timeout: float = 0.0):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self.rejected = 0
+        # Futures are created on the running loop, so one limiter works across loops
+        self._waiters: Deque["asyncio.Future"] = deque()
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_waiting or self.timeout <= 0:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return True
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # Pass the slot on; ``active`` stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, object]:
+        return {"active": self.active, "waiting": len(self._waiters), "rejected": self.rejected}
@@ -0,0 +1,196 @@
+import asyncio
+import json
+from typing import AsyncIterator, Callable, List, Optional
+
+HEARTBEAT = b": keep-alive\n\n"
+
+_DONE = object()
+
+
+class SSEParser:
+    """Incrementally splits a Server-Sent Events byte stream into events.
+
+    Upstream chunks can split or merge events arbitrarily; ``feed`` returns
+    only complete events (terminated by a blank line, normalized to ``\\n``)
+    and keeps any partial tail until more bytes arrive.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        self._buffer += chunk
+        if b"\r" in self._buffer:
+            # Keep a trailing \r back in case its \n is in the next chunk
+            tail = self._buffer.endswith(b"\r")
+            data = bytes(self._buffer[:-1] if tail else self._buffer)
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            self._buffer = bytearray(data + (b"\r" if tail else b""))
+
+        events = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n\n", start)
+            if end < 0:
+                break
+            event = bytes(self._buffer[start:end + 2])
+            start = end + 2
+            if event.strip(b"\n"):
+                events.append(event)
+        if start:
+            del self._buffer[:start]
+        return events
+
+    def flush(self) -> Optional[bytes]:
+        """Return whatever is left at end of stream as a terminated event."""
+        data = bytes(self._buffer).replace(b"\r", b"\n").strip(b"\n")
+        self._buffer.clear()
+        if not data:
+            return None
+        return data + b"\n\n"
+
+
+def event_data(event: bytes) -> str:
+    """Join the ``data:`` lines of a single event, per the SSE spec."""
+    lines = []
+    for line in event.decode("utf-8", errors="replace").split("\n"):
+        if line.startswith("data:"):
+            value = line[5:]
+            lines.append(value[1:] if value.startswith(" ") else value)
+    return "\n".join(lines)
+
+
+class ErrorEvent(bytes):
+    """An error frame generated by the proxy rather than relayed from upstream."""
+
+
+def error_event(message: str) -> ErrorEvent:
+    return ErrorEvent(b"data: " + json.dumps({"error": message}).encode() + b"\n\n")
+
+
+async def relay_events(
+    events: AsyncIterator[bytes],
+    max_buffered: int = 64,
+    heartbeat_interval: Optional[float] = 15.0,
+) -> AsyncIterator[bytes]:
+    """Forward events from ``events`` as soon as each one is complete.
+
+    Upstream is read by a separate task into a bounded queue, so a slow
+    client stops upstream reads once ``max_buffered`` events are waiting
+    instead of buffering without limit. While upstream is silent, comment
+    heartbeats are emitted so proxies don't time out or hold the stream.
+    Closing this generator cancels the upstream reader.
+    """
+    queue: "asyncio.Queue" = asyncio.Queue(maxsize=max_buffered)
+
+    async def produce():
+        try:
+            async for event in events:
+                await queue.put(event)
+            await queue.put(_DONE)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await queue.put(e)
+        finally:
+            aclose = getattr(events, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            if heartbeat_interval:
+                try:
+                    item = await asyncio.wait_for(queue.get(), heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+            else:
+                item = await queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class Broadcast:
+    """Fans a single event stream out to any number of subscribers.
+
+    The source is read once, by its own task, into a shared buffer. Each
+    subscriber first gets every event emitted so far and then follows live
+    events. If the last subscriber leaves before the source is exhausted,
+    the source is closed: ``closing`` is set and ``on_closing`` runs at once,
+    while closing the source may take a while longer, and anyone reading
+    the stream after that gets an error event instead of a clean end.
+    ``on_done`` runs once reading has stopped.
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[bytes],
+        on_done: Optional[Callable[[], None]] = None,
+        on_closing: Optional[Callable[[], None]] = None,
+    ):
+        self.events: List[bytes] = []
+        self.done = False
+        self.closing = False
+        self.subscribers = 0
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self._on_closing = on_closing
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _pump(self, source: AsyncIterator[bytes]):
+        try:
+            async for event in source:
+                self.events.append(event)
+                self._notify()
+        except asyncio.CancelledError:
+            self.events.append(error_event("Stream closed before it finished"))
+        except Exception as e:
+            self._error = e
+        finally:
+            self.done = True
+            self._notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            if self._on_done is not None:
+                self._on_done()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        self.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                if sent < len(self.events):
+                    event = self.events[sent]
+                    sent += 1
+                    yield event
+                elif self.done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done and not self.closing:
+                self.closing = True
+                if self._on_closing is not None:
+                    self._on_closing()
+                self._task.cancel()
@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+
+from balancer import UpstreamPool
+from resilience import CircuitBreaker
+
+
+def make_pool(*urls, **kwargs):
+    return UpstreamPool(list(urls), breaker_factory=lambda: CircuitBreaker(min_calls=1, open_seconds=30), **kwargs)
+
+
+def test_routes_to_least_outstanding():
+    pool = make_pool("http://a", "http://b")
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.url, second.url} == {"http://a", "http://b"}
+
+    pool.release(first)
+    assert pool.acquire() is first
+    assert first.active == 1 and second.active == 1
+
+
+def test_session_affinity_survives_load_but_not_ejection():
+    pool = make_pool("http://a", "http://b", unhealthy_after=1)
+    pinned = pool.acquire("s1")
+    # Pinned upstream is busier, the session still goes back to it
+    assert pool.acquire("s1") is pinned
+    assert pinned.active == 2
+
+    pool.record_probe(pinned, False)
+    assert not pinned.healthy
+    moved = pool.acquire("s1")
+    assert moved is not pinned
+    assert pool.acquire("s1") is moved
+
+
+def test_skips_upstreams_with_open_breaker():
+    pool = make_pool("http://a", "http://b")
+    a = pool.upstreams[0]
+    a.breaker.record_failure()
+    assert all(pool.acquire() is pool.upstreams[1] for _ in range(3))
+
+    pool.upstreams[1].breaker.record_failure()
+    assert pool.acquire() is None
+
+
+def test_ejects_and_reinstates_after_consecutive_probes():
+    pool = make_pool("http://a", "http://b", unhealthy_after=2, healthy_after=2)
+    a = pool.upstreams[0]
+    pool.record_probe(a, False)
+    assert a.healthy
+    pool.record_probe(a, False)
+    assert not a.healthy
+    assert all(pool.acquire() is pool.upstreams[1] for _ in range(3))
+
+    pool.record_probe(a, True)
+    assert not a.healthy
+    pool.record_probe(a, True)
+    assert a.healthy
+
+
+def test_all_ejected_falls_back_to_every_upstream():
+    pool = make_pool("http://a", unhealthy_after=1)
+    pool.record_probe(pool.upstreams[0], False)
+    assert pool.acquire() is pool.upstreams[0]
+
+
+def test_probe_checks_every_upstream():
+    pool = make_pool("http://a/v1", "http://b/v1", unhealthy_after=1)
+    seen = []
+
+    def handler(request):
+        seen.append(str(request.url))
+        if request.url.host == "b":
+            raise httpx.ConnectError("refused")
+        return httpx.Response(200)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await pool.probe(client, "/health")
+
+    asyncio.run(run())
+    assert sorted(seen) == ["http://a/v1/health", "http://b/v1/health"]
+    assert [u.healthy for u in pool.upstreams] == [True, False]
@@ -0,0 +1,175 @@
+import asyncio
+
+from cache import MemoryBackend, RedisBackend, TTLCache, backend_from_url
+
+
+def test_lru_eviction_by_entry_count():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_evicts_oldest():
+    cache = TTLCache(max_entries=100, max_bytes=250, sizeof=lambda v: 100)
+    cache.set("a", "x")
+    cache.set("b", "y")
+    cache.set("c", "z")
+
+    assert len(cache) == 2
+    assert cache.nbytes == 200
+    assert "a" not in cache
+
+
+def test_oversized_value_is_not_stored():
+    cache = TTLCache(max_bytes=10, sizeof=lambda v: len(v))
+    cache.set("a", "small")
+    cache.set("b", "x" * 100)
+
+    assert "b" not in cache
+    assert cache.get("a") == "small"
+
+
+def test_expiry_and_sweep(clock):
+    cache = TTLCache(ttl=10, clock=clock, sweep_interval=1000)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=100)
+
+    clock.now = 11
+    assert cache.get("a") is None
+    cache.set("c", 3, ttl=5)
+    clock.now = 20
+    assert cache.sweep() == 1
+    assert len(cache) == 1
+    assert cache.get("b") == 2
+
+
+def test_hit_and_miss_counters():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("missing")
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+class FakeRedis:
+    """Tiny stand-in that speaks enough RESP for RedisBackend."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.auth_delay = 0.0
+
+    async def handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            args = []
+            for _ in range(int(line[1:])):
+                length = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            command = args[0].upper()
+            self.commands.append(command)
+            if command == b"AUTH":
+                await asyncio.sleep(self.auth_delay)
+                writer.write(b"+OK\r\n")
+            elif command == b"GET":
+                value = self.data.get(args[1])
+                writer.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+            elif command == b"SET":
+                self.data[args[1]] = args[2]
+                writer.write(b"+OK\r\n")
+            elif command == b"DEL":
+                writer.write(b":%d\r\n" % (self.data.pop(args[1], None) is not None))
+            else:
+                writer.write(b"-ERR unknown command\r\n")
+            await writer.drain()
+        writer.close()
+
+
+def test_redis_backend_against_stand_in():
+    fake = FakeRedis()
+
+    async def run():
+        server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backend = backend_from_url(f"redis://127.0.0.1:{port}/0")
+        try:
+            assert await backend.get("k") is None
+            await backend.set("k", b"\x00value\r\n", ttl=60)
+            assert await backend.get("k") == b"\x00value\r\n"
+            await backend.delete("k")
+            assert await backend.get("k") is None
+        finally:
+            await backend.close()
+            server.close()
+
+    asyncio.run(run())
+    assert fake.commands == [b"GET", b"SET", b"GET", b"DEL", b"GET"]
+
+
+def test_redis_backend_reconnects_after_failed_auth():
+    fake = FakeRedis()
+    fake.data[b"k"] = b"v"
+    fake.auth_delay = 0.5
+
+    async def run():
+        server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backend = RedisBackend(f"redis://:secret@127.0.0.1:{port}/0", timeout=0.1)
+        try:
+            try:
+                await backend.get("k")
+            except asyncio.TimeoutError:
+                pass
+            else:
+                raise AssertionError("AUTH should have timed out")
+            # The late AUTH reply must not be taken as the answer to the next command
+            fake.auth_delay = 0.0
+            assert await backend.get("k") == b"v"
+        finally:
+            await backend.close()
+            server.close()
+
+    asyncio.run(run())
+    assert fake.commands == [b"AUTH", b"AUTH", b"GET"]
+
+
+def test_sqlite_backend_persists_across_instances(tmp_path):
+    url = f"sqlite:///{tmp_path / 'cache.db'}"
+
+    async def run():
+        first = backend_from_url(url)
+        await first.set("k", b"value", ttl=60)
+        await first.set("gone", b"value", ttl=-1)
+        await first.close()
+
+        second = backend_from_url(url)
+        try:
+            return await second.get("k"), await second.get("gone")
+        finally:
+            await second.close()
+
+    assert asyncio.run(run()) == (b"value", None)
+
+
+def test_memory_backend():
+    async def run():
+        backend = backend_from_url("memory://")
+        assert isinstance(backend, MemoryBackend)
+        await backend.set("k", b"v")
+        value = await backend.get("k")
+        await backend.delete("k")
+        return value, await backend.get("k")
+
+    assert asyncio.run(run()) == (b"v", None)
@@ -0,0 +1,20 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# Generous enough for slow CI machines; bench/cold_start.py has the real numbers
+BUDGET_MS = float(os.getenv("COLD_START_BUDGET_MS", "1500"))
+
+
+def test_cold_start_within_budget():
+    bench = Path(__file__).resolve().parent / "bench" / "cold_start.py"
+    out = subprocess.run(
+        [sys.executable, str(bench), "--runs", "3", "--json", "--budget-ms", str(BUDGET_MS)],
+        capture_output=True, text=True, timeout=120,
+    )
+    summary = json.loads(out.stdout.strip().splitlines()[-1])
+    assert summary["lazy_modules_loaded"] == []
+    assert summary["total_ms"]["median"] <= BUDGET_MS, out.stderr
+    assert out.returncode == 0, out.stderr
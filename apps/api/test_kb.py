@@ -0,0 +1,62 @@
+import os
+import time
+
+from kb import BM25Index, KnowledgeBase, split_markdown
+
+DOC = """# Knowledge Base
+
+## 1. Profile
+**Name:** Ada  
+Systems engineer who likes assembly.
+
+### Philosophy
+Zero-dependency architecture and deterministic control.
+
+---
+
+## 2. Catalyst
+Catalyst is an AI operating system with RAG and voice.
+"""
+
+
+def test_split_by_heading_keeps_heading_path():
+    chunks = split_markdown(DOC)
+    assert [c.title for c in chunks] == [
+        "Knowledge Base > 1. Profile",
+        "Knowledge Base > 1. Profile > Philosophy",
+        "Knowledge Base > 2. Catalyst",
+    ]
+    assert chunks[1].text.startswith("### Philosophy\n")
+    assert "---" not in chunks[1].text
+
+
+def test_bm25_ranks_matching_section_first():
+    index = BM25Index(split_markdown(DOC))
+    results = index.search("what is catalyst voice?", k=2)
+    assert results[0][0].title.endswith("2. Catalyst")
+    assert all(score > 0 for _, score in results)
+    assert index.search("unrelated words") == []
+
+
+def test_search_is_fast():
+    index = BM25Index(split_markdown(DOC * 50))
+    started = time.perf_counter()
+    for _ in range(1000):
+        index.search("deterministic architecture catalyst", k=5)
+    assert (time.perf_counter() - started) / 1000 < 0.001
+
+
+def test_rebuilds_only_when_file_changes(tmp_path):
+    path = tmp_path / "kb.md"
+    path.write_text(DOC)
+    changes = []
+    kb = KnowledgeBase(str(path), check_interval=0, on_change=lambda: changes.append(1))
+
+    first = kb.refresh()
+    assert kb.refresh() is first
+    assert changes == []
+
+    path.write_text(DOC + "\n## 3. Books\nCosmic Dice.\n")
+    os.utime(path, (time.time() + 5, time.time() + 5))
+    assert kb.search("cosmic dice")[0][0].title.endswith("3. Books")
+    assert changes == [1]
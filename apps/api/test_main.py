@@ -1,10 +1,1065 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
 from fastapi.testclient import TestClient
+
+import main
+from cache import MemoryBackend
 from main import app
 
 client = TestClient(app)
 
+
+def github_repo(name, updated_at="2025-01-01T00:00:00Z", **extra):
+    repo = {
+        "name": name,
+        "description": None,
+        "html_url": f"https://github.com/ppilafas/{name}",
+        "language": "Python",
+        "stargazers_count": 0,
+        "updated_at": updated_at,
+    }
+    repo.update(extra)
+    return repo
+
+
+def mock_github(handler):
+    main._http_clients["github"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture(autouse=True)
+def reset_state(monkeypatch):
+    monkeypatch.setattr(main, "GITHUB_ENRICH", False)
+    main._repos_cache.clear()
+    main._repos_inflight.clear()
+    main._repos_enriching.clear()
+    main._http_clients.clear()
+    main._github_rate.update(limit=None, remaining=None, reset=None)
+    for key in main._chat_stats:
+        main._chat_stats[key] = 0
+    main._chat_cache.clear()
+    main._chat_inflight.clear()
+    main._chat_session_limiter.clear()
+    main._chat_ip_limiter.clear()
+    monkeypatch.setattr(main, "_chat_streams", main.ConcurrencyLimiter(4, 2, 0.2))
+    monkeypatch.setattr(main, "_catalyst_upstreams", main.UpstreamPool(
+        ["http://catalyst.test/v1"],
+        breaker_factory=lambda: main.CircuitBreaker(min_calls=2, open_seconds=30),
+    ))
+    yield
+    main._repos_cache.clear()
+    main._repos_inflight.clear()
+    main._http_clients.clear()
+
+
 def test_health_check():
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json() == {"status": "ok", "service": "per4ex-api"}
 
+
+def test_github_repos_reuses_shared_client():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json=[github_repo("alpha")])
+
+    mock_github(handler)
+    shared = main.get_http_client("github")
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    assert response.status_code == 200
+    assert [r["name"] for r in response.json()["repos"]] == ["alpha"]
+    assert calls == ["/users/someone/repos"]
+    assert main.get_http_client("github") is shared
+
+
+def test_lifespan_opens_and_closes_pools():
+    with TestClient(app):
+        clients = dict(main._http_clients)
+        assert set(clients) == set(main.HTTP_POOLS)
+    assert main._http_clients == {}
+    assert all(c.is_closed for c in clients.values())
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=[github_repo("alpha")])
+
+    mock_github(handler)
+
+    async def burst():
+        return await asyncio.gather(*(main._get_repos_entry("someone") for _ in range(10)))
+
+    results = asyncio.run(burst())
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_stale_entry_served_while_refreshing():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json=[github_repo("fresh")])
+
+    mock_github(handler)
+    stale = main.RepoCacheEntry(user="someone", repos=[], fetched_at=time.time() - main.CACHE_TTL - 1)
+    main._repos_cache.set("someone", stale)
+
+    async def run():
+        first = await main._get_repos_entry("someone")
+        await main._repos_inflight["someone"]
+        second = await main._get_repos_entry("someone")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is stale
+    assert [r.name for r in second.repos] == ["fresh"]
+    assert len(calls) == 1
+
+
+def test_entry_past_hard_ttl_is_refetched():
+    mock_github(lambda request: httpx.Response(200, json=[github_repo("fresh")]))
+    expired = main.RepoCacheEntry(user="someone", repos=[], fetched_at=time.time() - main.CACHE_HARD_TTL - 1)
+    main._repos_cache.set("someone", expired)
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    assert [r["name"] for r in response.json()["repos"]] == ["fresh"]
+
+
+def test_fetch_error_falls_back_to_expired_entry():
+    mock_github(lambda request: httpx.Response(500))
+    old = [main.Repo(name="old", html_url="u", stargazers_count=0, updated_at="")]
+    main._repos_cache.set(
+        "someone", main.RepoCacheEntry(user="someone", repos=old, fetched_at=time.time() - main.CACHE_HARD_TTL - 1)
+    )
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    assert [r["name"] for r in response.json()["repos"]] == ["old"]
+
+
+def test_fetch_error_without_cached_entry_returns_empty_list():
+    mock_github(lambda request: httpx.Response(500))
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    assert response.json() == {"user": "someone", "repos": [], "total": 0, "next_cursor": None}
+    assert "someone" not in main._repos_cache
+
+
+def test_unchanged_repos_are_revalidated_with_etag():
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=[github_repo("alpha")], headers={"ETag": '"v1"'})
+
+    mock_github(handler)
+
+    async def run():
+        first = await main._get_repos_entry("someone")
+        first.fetched_at -= main.CACHE_TTL + 1
+        await main._get_repos_entry("someone")
+        await main._repos_inflight["someone"]
+        return first, main._repos_cache.get("someone")
+
+    first, entry = asyncio.run(run())
+    assert seen == [None, '"v1"']
+    assert entry is first
+    assert time.time() - entry.fetched_at < 5
+
+
+def test_low_rate_budget_stretches_refresh_interval():
+    now = time.time()
+    main._github_rate.update(limit=60, remaining=60, reset=now + 3600)
+    assert main._refresh_interval(now) == main.CACHE_TTL
+
+    main._github_rate.update(remaining=6)
+    assert main._refresh_interval(now) == main.CACHE_TTL * 5
+
+    main._github_rate.update(remaining=0)
+    assert main._refresh_interval(now) >= 3599
+
+
+def test_exhausted_rate_budget_skips_upstream():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=[], headers={
+            "X-RateLimit-Limit": "60",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(int(time.time()) + 600),
+        })
+
+    mock_github(handler)
+    client.get("/api/github/repos", params={"user": "a"})
+    response = client.get("/api/github/repos", params={"user": "b"})
+
+    assert response.json()["repos"] == []
+    assert len(calls) == 1
+
+
+def paged_github(repos, page_size=2):
+    # Mimics GitHub's page/per_page pagination with a Link header
+    def handler(request):
+        page = int(request.url.params.get("page", "1"))
+        last = max(1, -(-len(repos) // page_size))
+        headers = {}
+        if last > 1:
+            base = str(request.url.copy_remove_param("page"))
+            headers["Link"] = f'<{base}&page={min(page + 1, last)}>; rel="next", <{base}&page={last}>; rel="last"'
+        body = repos[(page - 1) * page_size:page * page_size]
+        return httpx.Response(200, json=body, headers=headers)
+    return handler
+
+
+def test_all_pages_are_fetched():
+    repos = [github_repo(f"repo{i}", updated_at=f"2025-01-{i + 1:02d}T00:00:00Z") for i in range(5)]
+    mock_github(paged_github(repos))
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    names = [r["name"] for r in response.json()["repos"]]
+    assert names == ["repo4", "repo3", "repo2", "repo1", "repo0"]
+    assert len(main._repos_cache.get("someone").validators) == 3
+
+
+def test_page_cap_is_logged_and_counted(monkeypatch, caplog):
+    monkeypatch.setattr(main, "GITHUB_MAX_PAGES", 2)
+    repos = [github_repo(f"repo{i}", updated_at=f"2025-01-{i + 1:02d}T00:00:00Z") for i in range(5)]
+    mock_github(paged_github(repos))
+    before = main._github_truncated._default.value
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    assert response.json()["total"] == 4
+    assert main._github_truncated._default.value == before + 1
+    assert any("only the first 2" in r.getMessage() for r in caplog.records)
+
+
+def test_filter_sort_and_paginate():
+    repos = [
+        github_repo("a", language="Python", stargazers_count=5),
+        github_repo("b", language="Go", stargazers_count=50),
+        github_repo("c", language="python", stargazers_count=20),
+        github_repo("d", language="Python", stargazers_count=1),
+    ]
+    mock_github(lambda request: httpx.Response(200, json=repos))
+
+    params = {"user": "someone", "language": "Python", "min_stars": 2, "sort": "stars", "limit": 1}
+    first = client.get("/api/github/repos", params=params).json()
+    assert [r["name"] for r in first["repos"]] == ["c"]
+    assert first["total"] == 2
+
+    second = client.get("/api/github/repos", params={**params, "cursor": first["next_cursor"]}).json()
+    assert [r["name"] for r in second["repos"]] == ["a"]
+    assert second["next_cursor"] is None
+
+    by_name = client.get("/api/github/repos", params={"user": "someone", "sort": "name"}).json()
+    assert [r["name"] for r in by_name["repos"]] == ["a", "b", "c", "d"]
+
+    assert client.get("/api/github/repos", params={"user": "someone", "cursor": "x"}).status_code == 400
+    assert client.get("/api/github/repos", params={"user": "someone", "sort": "size"}).status_code == 422
+
+
+def test_persisted_repos_survive_a_cold_start(monkeypatch):
+    monkeypatch.setattr(main, "_repos_backend", MemoryBackend())
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=[github_repo("alpha")])
+
+    mock_github(handler)
+
+    async def run():
+        await main._get_repos_entry("someone")
+        main._repos_cache.clear()  # simulate a fresh process
+        return await main._get_repos_entry("someone")
+
+    entry = asyncio.run(run())
+    assert [r.name for r in entry.repos] == ["alpha"]
+    assert len(calls) == 1
+
+
+def test_repos_response_is_http_cacheable():
+    mock_github(lambda request: httpx.Response(200, json=[github_repo("alpha")]))
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    etag = response.headers["etag"]
+    cache_control = response.headers["cache-control"]
+    assert f"max-age={main.CACHE_TTL}" in cache_control or f"max-age={main.CACHE_TTL - 1}" in cache_control
+    assert "s-maxage=" in cache_control and "stale-while-revalidate=" in cache_control
+
+    revalidated = client.get("/api/github/repos", params={"user": "someone"}, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+    filtered = client.get("/api/github/repos", params={"user": "someone", "limit": 1}, headers={"If-None-Match": etag})
+    assert filtered.status_code == 200
+    assert filtered.headers["etag"] != etag
+
+
+def test_failed_fetch_is_not_cacheable():
+    mock_github(lambda request: httpx.Response(500))
+
+    response = client.get("/api/github/repos", params={"user": "someone"})
+    assert response.headers["cache-control"] == "no-store"
+
+
+def test_unfiltered_listing_is_served_pre_compressed():
+    mock_github(lambda request: httpx.Response(200, json=[github_repo("alpha", description=None)]))
+
+    plain = client.get("/api/github/repos", params={"user": "someone"}, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.json()["repos"][0]["name"] == "alpha"
+    assert plain.json()["repos"][0]["description"] is None
+
+    gzipped = client.get("/api/github/repos", params={"user": "someone"}, headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in gzipped.headers["vary"]
+    assert gzipped.json() == plain.json()
+    assert gzipped.headers["etag"] != plain.headers["etag"]
+
+    entry = main._repos_cache.get("someone")
+    assert gzipped.content == plain.content == entry.bodies["identity"]
+
+    if "br" in entry.bodies:
+        br = client.get("/api/github/repos", params={"user": "someone"}, headers={"Accept-Encoding": "gzip, br"})
+        assert br.headers["content-encoding"] == "br"
+
+
+def test_negotiate_encoding():
+    available = {"identity": b"", "gzip": b"", "br": b""}
+    assert main._negotiate_encoding("gzip, deflate, br", available) == "br"
+    assert main._negotiate_encoding("gzip, br;q=0", available) == "gzip"
+    assert main._negotiate_encoding("*", {"identity": b"", "gzip": b""}) == "gzip"
+    assert main._negotiate_encoding("", available) == "identity"
+    assert main._negotiate_encoding("gzip;q=1, br;q=0.1", available) == "gzip"
+    assert main._negotiate_encoding("gzip;q=0.5, identity", available) == "identity"
+    assert main._negotiate_encoding("br;q=0, gzip;q=0", available) == "identity"
+
+
+def test_batch_returns_partial_results():
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        user = request.url.path.split("/")[2]
+        if user == "missing":
+            return httpx.Response(404, json={"message": "Not Found"})
+        return httpx.Response(200, json=[github_repo(f"{user}-repo")])
+
+    mock_github(handler)
+    users = ["a", "missing", "b", "c", "d", "e", "a"]
+
+    response = client.get("/api/github/repos", params={"users": ",".join(users)})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["user"] for r in results] == ["a", "missing", "b", "c", "d", "e"]
+    assert results[0]["status"] == "ok"
+    assert [r["name"] for r in results[0]["repos"]] == ["a-repo"]
+    assert results[1]["status"] == "not_found"
+    assert results[1]["repos"] == []
+    assert peak <= main.GITHUB_BATCH_CONCURRENCY
+
+
+def test_batch_rejects_too_many_users():
+    users = ",".join(f"u{i}" for i in range(main.GITHUB_BATCH_MAX_USERS + 1))
+    assert client.get("/api/github/repos", params={"users": users}).status_code == 400
+
+
+def test_enrichment_only_refetches_changed_repos(monkeypatch):
+    monkeypatch.setattr(main, "GITHUB_ENRICH", True)
+    listing = [
+        github_repo("alpha", updated_at="2025-01-02T00:00:00Z", topics=["ai"]),
+        github_repo("beta", updated_at="2025-01-01T00:00:00Z"),
+    ]
+    enriched = []
+
+    def handler(request):
+        if request.url.path.endswith("/languages"):
+            name = request.url.path.split("/")[3]
+            enriched.append(name)
+            return httpx.Response(200, json={"Python": len(enriched) * 100})
+        return httpx.Response(200, json=listing)
+
+    mock_github(handler)
+
+    async def run():
+        await main._get_repos_entry("someone")
+        await asyncio.gather(*main._repos_enriching.values())
+        first = main._repos_cache.get("someone")
+        listing[1] = github_repo("beta", updated_at="2025-01-03T00:00:00Z")
+        first.fetched_at -= main.CACHE_TTL + 1
+        await main._get_repos_entry("someone")
+        await main._repos_inflight["someone"]
+        await asyncio.gather(*main._repos_enriching.values())
+        return first, main._repos_cache.get("someone")
+
+    first, second = asyncio.run(run())
+    assert sorted(enriched) == ["alpha", "beta", "beta"]
+    by_name = {r.name: r for r in second.repos}
+    assert by_name["alpha"].languages == {r.name: r for r in first.repos}["alpha"].languages
+    assert by_name["alpha"].topics == ["ai"]
+    assert by_name["beta"].languages == {"Python": 300}
+
+
+def test_enrichment_runs_after_the_listing_is_served(monkeypatch):
+    monkeypatch.setattr(main, "GITHUB_ENRICH", True)
+    enriched = []
+
+    def handler(request):
+        if request.url.path.endswith("/languages"):
+            enriched.append(request.url.path)
+            return httpx.Response(200, json={"Python": 100})
+        return httpx.Response(200, json=[github_repo(f"repo{i}") for i in range(10)])
+
+    mock_github(handler)
+
+    async def run():
+        entry = await main._get_repos_entry("someone")
+        served = [r.languages for r in entry.repos]
+        await asyncio.gather(*main._repos_enriching.values())
+        return served, main._repos_cache.get("someone")
+
+    served, cached = asyncio.run(run())
+    # The entry handed to the first caller is never mutated by enrichment
+    assert served == [None] * 10
+    # No rate limit headers seen yet, so only a conservative number of calls
+    assert len(enriched) == main.GITHUB_ENRICH_MAX_UNKNOWN_RATE
+    assert sum(r.languages is not None for r in cached.repos) == main.GITHUB_ENRICH_MAX_UNKNOWN_RATE
+
+
+def test_enrichment_respects_rate_budget(monkeypatch):
+    monkeypatch.setattr(main, "GITHUB_ENRICH", True)
+    main._github_rate.update(limit=60, remaining=10, reset=time.time() + 3600)
+    paths = []
+
+    def handler(request):
+        paths.append(request.url.path)
+        return httpx.Response(200, json=[github_repo("alpha")])
+
+    mock_github(handler)
+
+    async def run():
+        await main._get_repos_entry("someone")
+        await asyncio.gather(*main._repos_enriching.values())
+        return main._repos_cache.get("someone")
+
+    entry = asyncio.run(run())
+    assert paths == ["/users/someone/repos"]
+    assert entry.repos[0].languages is None
+
+
+def mock_catalyst(handler):
+    main._http_clients["catalyst"] = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def chunked(*chunks, delay=0.0):
+    for chunk in chunks:
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk
+
+
+def test_chat_proxy_forwards_whole_events(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    mock_catalyst(lambda request: httpx.Response(200, content=chunked(b'data: {"t": "He', b'llo"}\n\ndata: {"t": "!"}\n', b"\n")))
+
+    response = client.post("/api/chat", json={"message": "hi"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.content == b'data: {"t": "Hello"}\n\ndata: {"t": "!"}\n\n'
+
+
+def test_chat_proxy_reports_upstream_errors(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    mock_catalyst(lambda request: httpx.Response(502))
+
+    response = client.post("/api/chat", json={"message": "hi"})
+    assert response.content == b'data: {"error": "Upstream error 502"}\n\n'
+
+
+class DisconnectingRequest:
+    def __init__(self, after):
+        self.after = after
+
+    async def receive(self):
+        await asyncio.sleep(self.after)
+        return {"type": "http.disconnect"}
+
+
+def test_disconnect_closes_upstream_stream():
+    closed = asyncio.Event()
+
+    async def upstream():
+        try:
+            while True:
+                yield b"data: x\n\n"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    async def run():
+        main._chat_stats.update(completed=1, completed_bytes=1000, completed_seconds=10.0)
+        relayed = [e async for e in main._stream_until_disconnect(upstream(), DisconnectingRequest(0.05))]
+        await asyncio.wait_for(closed.wait(), 1)
+        return relayed
+
+    relayed = asyncio.run(run())
+    assert 0 < len(relayed) < 20
+    assert main._chat_stats["cancelled"] == 1
+    assert main._chat_stats["cancelled_seconds_saved"] > 9
+    assert main._chat_stats["cancelled_bytes_saved"] == 1000 - len(relayed) * len(b"data: x\n\n")
+
+
+def test_disconnect_is_counted_under_uvicorn(monkeypatch):
+    # uvicorn speaks ASGI 2.3, so Starlette also watches for the disconnect and
+    # cancels the body generator itself; the accounting must survive that
+    import socket
+    import uvicorn
+
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    closed = asyncio.Event()
+
+    async def upstream():
+        try:
+            for _ in range(1000):
+                yield b"data: x\n\n"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    mock_catalyst(lambda request: httpx.Response(200, content=upstream()))
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def run():
+        server = uvicorn.Server(uvicorn.Config(app, port=port, lifespan="off", log_level="warning"))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        try:
+            async with httpx.AsyncClient() as http:
+                async with http.stream("POST", f"http://127.0.0.1:{port}/api/chat", json={"message": "hi"}) as resp:
+                    async for _ in resp.aiter_raw():
+                        break
+            await asyncio.wait_for(closed.wait(), 2)
+            for _ in range(100):
+                if main._chat_stats["cancelled"]:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            server.should_exit = True
+            await serving
+
+    asyncio.run(run())
+    assert main._chat_stats["cancelled"] == 1
+    assert main._chat_stats["completed"] == 0
+    assert main._catalyst_upstreams.upstreams[0].active == 0
+
+
+def test_ttfb_and_bytes_ignore_heartbeats():
+    async def upstream():
+        yield main.HEARTBEAT
+        yield main.HEARTBEAT
+        yield b"data: x\n\n"
+
+    class ConnectedRequest:
+        async def receive(self):
+            await asyncio.sleep(10)
+
+    async def run():
+        return [e async for e in main._stream_until_disconnect(upstream(), ConnectedRequest())]
+
+    before = sum(main._chat_ttfb._default.counts)
+    assert len(asyncio.run(run())) == 3
+    assert sum(main._chat_ttfb._default.counts) == before + 1
+    assert main._chat_stats["completed_bytes"] == len(b"data: x\n\n")
+
+
+def test_completed_stream_is_counted(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    mock_catalyst(lambda request: httpx.Response(200, content=b"data: 1\n\n"))
+
+    client.post("/api/chat", json={"message": "hi"})
+    assert main._chat_stats["completed"] == 1
+    assert main._chat_stats["completed_bytes"] == len(b"data: 1\n\n")
+    assert main._chat_stats["cancelled"] == 0
+
+
+def test_open_circuit_fails_fast(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("connection refused")
+
+    mock_catalyst(handler)
+    for _ in range(2):
+        response = client.post("/api/chat", json={"message": "hi"})
+        assert b"Catalyst is unavailable" in response.content
+
+    response = client.post("/api/chat", json={"message": "hi"})
+    assert b"temporarily unavailable" in response.content
+    assert len(calls) == 2
+    assert main._catalyst_upstreams.upstreams[0].breaker.state == "open"
+
+
+def test_cancelled_probe_does_not_wedge_the_breaker(monkeypatch):
+    breaker = main.CircuitBreaker(min_calls=1, open_seconds=0.05)
+    monkeypatch.setattr(main, "_catalyst_upstreams", main.UpstreamPool(
+        ["http://catalyst.test/v1"], breaker_factory=lambda: breaker,
+    ))
+
+    async def handler(request):
+        await asyncio.sleep(10)
+
+    mock_catalyst(handler)
+    breaker.record_failure()
+
+    async def run():
+        await asyncio.sleep(0.06)
+        # The client goes away while the half-open probe is still connecting
+        events = main._catalyst_events({"messages": []}, {})
+        probe = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open" and not breaker.allow()
+        probe.cancel()
+        await asyncio.wait({probe})
+        await events.aclose()
+
+    asyncio.run(run())
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_first_byte_timeout(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    monkeypatch.setattr(main, "CATALYST_FIRST_BYTE_TIMEOUT", 0.05)
+    mock_catalyst(lambda request: httpx.Response(200, content=chunked(b"data: late\n\n", delay=0.5)))
+
+    started = time.monotonic()
+    response = client.post("/api/chat", json={"message": "hi"})
+    assert time.monotonic() - started < 0.4
+    assert b"did not respond in time" in response.content
+    assert main._catalyst_upstreams.upstreams[0].breaker.stats()["recent_calls"] == 1
+
+
+def test_stateless_answers_are_cached_and_replayed(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    monkeypatch.setattr(main, "CHAT_CACHE_ENABLED", True)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, content=chunked(b"data: Hello\n\n", b"data: [DONE]\n\n"))
+
+    mock_catalyst(handler)
+
+    first = client.post("/api/chat", json={"message": "Who is Panagiotis?"})
+    second = client.post("/api/chat", json={"message": "  who is   panagiotis "})
+    with_session = client.post("/api/chat", json={"message": "Who is Panagiotis?", "session_id": "s1"})
+
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert "x-cache" not in with_session.headers
+    assert second.content == first.content == b"data: Hello\n\ndata: [DONE]\n\n"
+    assert len(calls) == 2
+
+
+def test_error_answers_are_not_cached(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    monkeypatch.setattr(main, "CHAT_CACHE_ENABLED", True)
+    mock_catalyst(lambda request: httpx.Response(500))
+
+    client.post("/api/chat", json={"message": "hi"})
+    assert len(main._chat_cache) == 0
+
+
+def test_chat_cache_invalidation_endpoint(monkeypatch):
+    main._chat_cache.set("k", ((0.0, b"data: x\n\n"),))
+    assert client.post("/api/chat/cache/invalidate").status_code == 503
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "admin")
+    assert client.post("/api/chat/cache/invalidate").status_code == 401
+    response = client.post("/api/chat/cache/invalidate", headers={"Authorization": "Bearer admin"})
+    assert response.json() == {"invalidated": 1}
+    assert len(main._chat_cache) == 0
+
+
+def test_replay_keeps_original_timing(monkeypatch):
+    monkeypatch.setattr(main, "CHAT_CACHE_REPLAY_TIMING", True)
+
+    async def run():
+        started = time.monotonic()
+        events = [e async for e in main._replay_events(((0.0, b"a"), (0.1, b"b")))]
+        return events, time.monotonic() - started
+
+    events, elapsed = asyncio.run(run())
+    assert events == [b"a", b"b"]
+    assert elapsed >= 0.09
+
+
+def test_kb_search_endpoint():
+    response = client.get("/api/kb/search", params={"q": "Catalyst tenant isolation", "k": 3})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert 0 < len(results) <= 3
+    assert "Catalyst" in results[0]["title"]
+
+
+def test_payload_includes_relevant_kb_and_recent_history(monkeypatch):
+    monkeypatch.setattr(main, "CHAT_CONTEXT_TOKENS", 1200)
+    history = [{"role": "user", "content": "old " * 2000}] + [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i}"} for i in range(4)
+    ]
+    request = main.ChatRequest(message="Tell me about Catalyst tenant isolation", history=history)
+
+    payload = main._build_catalyst_payload(request)
+    messages = payload["messages"]
+    assert [m["content"] for m in messages[:-1]] == ["turn 0", "turn 1", "turn 2", "turn 3"]
+    assert messages[-1]["role"] == "user"
+    assert "Tenant Isolation" in messages[-1]["content"]
+    assert messages[-1]["content"].endswith("USER QUESTION:\nTell me about Catalyst tenant isolation")
+    assert sum(main.estimate_tokens(m["content"]) for m in messages) <= 1200
+    assert payload["config"] == {"namespace": main.CATALYST_NAMESPACE}
+
+
+def test_proxy_sends_assembled_payload(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    sent = []
+
+    def handler(request):
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, content=b"data: ok\n\n")
+
+    mock_catalyst(handler)
+    client.post("/api/chat", json={"message": "hi", "session_id": "s1"})
+    assert sent[0]["session_id"] == "s1"
+    assert sent[0]["messages"][-1]["role"] == "user"
+
+
+def test_chat_spreads_streams_and_keeps_sessions_on_their_upstream(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "admin")
+    monkeypatch.setattr(main, "_catalyst_upstreams", main.UpstreamPool(
+        ["http://one.test/v1", "http://two.test/v1"],
+        breaker_factory=lambda: main.CircuitBreaker(min_calls=2, open_seconds=30),
+    ))
+    hosts = []
+
+    def handler(request):
+        hosts.append(request.url.host)
+        return httpx.Response(200, content=b"data: ok\n\n")
+
+    mock_catalyst(handler)
+    client.post("/api/chat", json={"message": "hi", "session_id": "a"})
+    client.post("/api/chat", json={"message": "hi", "session_id": "b"})
+    client.post("/api/chat", json={"message": "again", "session_id": "a"})
+    assert hosts[0] != hosts[1]
+    assert hosts[2] == hosts[0]
+
+    response = client.get("/api/chat/upstreams", headers={"Authorization": "Bearer admin"})
+    stats = response.json()["upstreams"]
+    assert [u["active"] for u in stats] == [0, 0]
+    assert sum(u["requests"] for u in stats) == 3
+
+
+def test_chat_rate_limited_per_session_and_ip(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    monkeypatch.setattr(main, "_chat_session_limiter", main.RateLimiter(1 / 60, 2))
+    monkeypatch.setattr(main, "_chat_ip_limiter", main.RateLimiter(1 / 60, 3))
+    mock_catalyst(lambda request: httpx.Response(200, content=b"data: ok\n\n"))
+
+    statuses = [client.post("/api/chat", json={"message": "hi", "session_id": "s"}).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+    # Another session from the same address has one request left
+    assert client.post("/api/chat", json={"message": "hi", "session_id": "t"}).status_code == 200
+    response = client.post("/api/chat", json={"message": "hi"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    # A made-up X-Forwarded-For doesn't buy a fresh bucket
+    response = client.post("/api/chat", json={"message": "hi"}, headers={"X-Forwarded-For": "10.0.0.1"})
+    assert response.status_code == 429
+
+
+def test_client_ip_only_trusts_forwarded_for_from_configured_proxies(monkeypatch):
+    monkeypatch.setattr(main, "CHAT_TRUSTED_PROXIES", [main.ipaddress.ip_network("10.0.0.0/8")])
+
+    def client_ip(peer, headers):
+        return main._client_ip(main.HTTPConnection({
+            "type": "http",
+            "client": (peer, 50000),
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        }))
+
+    assert client_ip("203.0.113.5", {"X-Forwarded-For": "1.2.3.4"}) == "203.0.113.5"
+    # The hop our proxy appended wins over whatever the client put in front of it
+    assert client_ip("10.0.0.2", {"X-Forwarded-For": "1.2.3.4, 198.51.100.7, 10.0.0.3"}) == "198.51.100.7"
+    assert client_ip("10.0.0.2", {"X-Real-IP": "198.51.100.7"}) == "198.51.100.7"
+    assert client_ip("10.0.0.2", {}) == "10.0.0.2"
+
+
+def test_chat_concurrency_cap_queues_then_rejects(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    monkeypatch.setattr(main, "_chat_streams", main.ConcurrencyLimiter(1, 1, 0.2))
+    mock_catalyst(lambda request: httpx.Response(200, content=chunked(b"data: ok\n\n", delay=0.5)))
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(
+                http.post("/api/chat", json={"message": "hi", "session_id": str(i)}) for i in range(3)
+            ))
+
+    responses = asyncio.run(run())
+    assert sorted(r.status_code for r in responses) == [200, 429, 429]
+    assert main._chat_streams.active == 0
+
+
+def test_identical_questions_share_one_upstream_stream(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, content=chunked(b"data: one\n\n", b"data: two\n\n", b"data: three\n\n", delay=0.1))
+
+    mock_catalyst(handler)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            async def ask(delay, message):
+                await asyncio.sleep(delay)
+                return await http.post("/api/chat", json={"message": message})
+
+            # The late joiner arrives after the first event has gone out
+            return await asyncio.gather(ask(0, "What is Per4ex?"), ask(0.01, "what is per4ex"), ask(0.15, "What is Per4ex?"))
+
+    responses = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r.content == b"data: one\n\ndata: two\n\ndata: three\n\n" for r in responses)
+    assert [r.headers.get("x-coalesced") for r in responses] == [None, "1", "1"]
+    assert main._chat_stats["coalesced"] == 2
+    assert main._chat_inflight == {}
+    assert main._chat_streams.active == 0
+
+
+def test_abandoned_flight_is_not_joined_while_it_closes():
+    released = []
+
+    async def upstream():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield b"data: partial\n\n"
+        finally:
+            await asyncio.sleep(0.05)
+
+    async def run():
+        flight = main._start_flight("q", upstream(), lambda: released.append(True))
+        stream = flight.subscribe()
+        await stream.__anext__()
+        await stream.aclose()
+        # Gone from the table straight away, while upstream is still closing
+        assert "q" not in main._chat_inflight
+        assert not released
+        await asyncio.sleep(0.1)
+        assert released == [True]
+
+    asyncio.run(run())
+
+
+def test_websocket_turn_errors_are_logged_not_swallowed(monkeypatch, caplog):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    mock_catalyst(lambda request: httpx.Response(200, content=b"data: ok\n\n"))
+
+    async def broken_relay(turn_id, turn, send):
+        await turn.events.aclose()
+        turn.release()
+        raise RuntimeError("relay bug")
+
+    monkeypatch.setattr(main, "_relay_turn_frames", broken_relay)
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"id": "1", "message": "hi", "session_id": "s"})
+        assert ws.receive_json() == {"id": "1", "error": "Chat turn failed"}
+
+    assert any("Chat turn 1 failed" in r.getMessage() and r.exc_info for r in caplog.records)
+
+
+def test_websocket_multiplexes_turns(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+
+    def handler(request):
+        question = json.loads(request.content)["messages"][-1]["content"].rsplit("\n", 1)[-1]
+        return httpx.Response(200, content=chunked(f"data: {question}\n\n".encode(), b"data: [DONE]\n\n", delay=0.05))
+
+    mock_catalyst(handler)
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"id": "a", "message": "first", "session_id": "s1"})
+        ws.send_json({"id": "b", "message": "second", "session_id": "s2"})
+        frames = {"a": [], "b": []}
+        while not all(f and f[-1].get("done") for f in frames.values()):
+            frame = ws.receive_json()
+            frames[frame["id"]].append(frame)
+
+    assert [f.get("data") for f in frames["a"]] == ["first", "[DONE]", None]
+    assert [f.get("data") for f in frames["b"]] == ["second", "[DONE]", None]
+    assert main._chat_stats["completed"] == 2
+    assert main._chat_streams.active == 0
+
+
+def test_websocket_cancel_closes_upstream_and_limits_apply(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    monkeypatch.setattr(main, "_chat_session_limiter", main.RateLimiter(1 / 60, 1))
+    mock_catalyst(lambda request: httpx.Response(200, content=chunked(*[b"data: tick\n\n"] * 50, delay=0.05)))
+
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"id": "1", "message": "long", "session_id": "s"})
+        assert ws.receive_json() == {"id": "1", "data": "tick"}
+        ws.send_json({"id": "1", "cancel": True})
+        frame = ws.receive_json()
+        while frame.get("data"):
+            frame = ws.receive_json()
+        assert frame == {"id": "1", "cancelled": True}
+
+        ws.send_json({"id": "2", "message": "again", "session_id": "s"})
+        frame = ws.receive_json()
+        assert frame["id"] == "2" and frame["error"] == "Too many chat requests"
+        assert frame["retry_after"] >= 1
+
+        ws.send_text("not json")
+        assert ws.receive_json() == {"error": "Invalid frame"}
+
+    assert main._chat_stats["cancelled"] == 1
+    assert main._chat_streams.active == 0
+
+
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    mock_github(lambda request: httpx.Response(200, json=[github_repo("a")]))
+    mock_catalyst(lambda request: httpx.Response(200, content=b"data: ok\n\n"))
+    client.get("/api/github/repos?user=metrics-user")
+    client.get("/api/github/repos?user=metrics-user")
+    client.post("/api/chat", json={"message": "hi", "session_id": "m"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/github/repos",status="200"}' in text
+    assert 'github_repos_cache_lookups_total{result="hit"}' in text
+    assert 'github_repos_cache_lookups_total{result="miss"}' in text
+    assert 'github_request_duration_seconds_count{status="200"}' in text
+    assert "chat_ttfb_seconds_count" in text
+    assert 'chat_stream_duration_seconds_count{outcome="completed"}' in text
+    assert 'catalyst_upstream_open_streams{upstream="0"} 0' in text
+    assert "catalyst.test" not in text
+    assert "chat_open_streams 0" in text
+
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape"}).status_code == 200
+
+
+def test_request_id_is_forwarded_to_catalyst(monkeypatch):
+    monkeypatch.setattr(main, "CATALYST_API_KEY", "secret")
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("x-request-id"))
+        return httpx.Response(200, content=b"data: ok\n\n")
+
+    mock_catalyst(handler)
+    response = client.post("/api/chat", json={"message": "hi", "session_id": "r"}, headers={"X-Request-Id": "trace-1"})
+    assert response.headers["x-request-id"] == "trace-1"
+    assert response.headers["server-timing"].startswith("queue;dur=")
+    assert seen == ["trace-1"]
+
+    client.post("/api/chat", json={"message": "hi", "session_id": "r"})
+    assert seen[1] and seen[1] != "trace-1"
+    assert 'chat_span_seconds_count{span="ttfb"} 2' in client.get("/metrics").text
+
+
+def test_profiling_rate_can_be_changed_at_runtime(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "admin")
+    monkeypatch.setattr(main._profiler, "directory", str(tmp_path))
+    auth = {"Authorization": "Bearer admin"}
+    assert client.post("/api/debug/profiling?rate=1").status_code == 401
+
+    assert client.post("/api/debug/profiling?rate=1", headers=auth).json()["rate"] == 1
+    try:
+        client.get("/health")
+    finally:
+        client.post("/api/debug/profiling?rate=0", headers=auth)
+    assert list(tmp_path.glob("*-health-*.prof"))
+
+
+def test_repo_snapshot_round_trip(monkeypatch, tmp_path):
+    snapshot = tmp_path / "repos.snapshot"
+    monkeypatch.setattr(main, "GITHUB_CACHE_SNAPSHOT", str(snapshot))
+    monkeypatch.setattr(main, "_repos_snapshot", None)
+    mock_github(lambda request: httpx.Response(200, json=[github_repo("warm")]))
+    client.get("/api/github/repos?user=snap")
+    main._write_repos_snapshot(str(snapshot))
+
+    # A new process: empty memory cache, snapshot not read yet, GitHub unreachable
+    main._repos_cache.clear()
+    main._repos_snapshot = None
+
+    def unreachable(request):
+        raise httpx.ConnectError("offline")
+
+    mock_github(unreachable)
+    response = client.get("/api/github/repos?user=snap")
+    assert [r["name"] for r in response.json()["repos"]] == ["warm"]
+    assert "snap" not in main._repos_snapshot
+
+
+def test_repo_snapshot_merges_workers_and_skips_bad_lines(monkeypatch, tmp_path):
+    snapshot = tmp_path / "repos.snapshot"
+    monkeypatch.setattr(main, "GITHUB_CACHE_SNAPSHOT", str(snapshot))
+    monkeypatch.setattr(main, "_repos_snapshot", None)
+    old = main.RepoCacheEntry(user="both", repos=[], fetched_at=time.time() - 60)
+    new = main.RepoCacheEntry(user="both", repos=[], fetched_at=time.time())
+
+    # First worker shuts down with "one" and a fresh "both"; its file gets a torn line
+    main._repos_cache.set("one", main.RepoCacheEntry(user="one", repos=[], fetched_at=time.time()))
+    main._repos_cache.set("both", new)
+    main._write_repos_snapshot(str(snapshot))
+    with open(snapshot, "ab") as f:
+        f.write(b'{"user": "torn", "repos": [\n')
+
+    # Second worker only has "two" and an older "both"
+    main._repos_cache.clear()
+    main._repos_cache.set("two", main.RepoCacheEntry(user="two", repos=[], fetched_at=time.time()))
+    main._repos_cache.set("both", old)
+    main._write_repos_snapshot(str(snapshot))
+    assert not [p for p in tmp_path.iterdir() if p != snapshot]
+
+    main._repos_cache.clear()
+    assert main._load_snapshot_repos("one") is not None
+    assert main._load_snapshot_repos("two") is not None
+    assert main._load_snapshot_repos("both").fetched_at == new.fetched_at
+    assert main._load_snapshot_repos("torn") is None
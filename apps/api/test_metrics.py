@@ -0,0 +1,64 @@
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from metrics import Registry, RouteTimingMiddleware
+
+
+def test_counters_gauges_and_labels_render():
+    registry = Registry()
+    lookups = registry.counter("lookups_total", "Lookups", labels=("result",))
+    open_streams = registry.gauge("open_streams", "Open streams")
+    lookups.labels("hit").inc()
+    lookups.labels("hit").inc()
+    lookups.labels('we"ird').inc(0.5)
+    open_streams.inc()
+    open_streams.inc()
+    open_streams.dec()
+
+    text = registry.render()
+    assert "# TYPE lookups_total counter" in text
+    assert 'lookups_total{result="hit"} 2' in text
+    assert 'lookups_total{result="we\\"ird"} 0.5' in text
+    assert "open_streams 1" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 3.65" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_collectors_are_read_at_scrape_time():
+    registry = Registry()
+    state = {"entries": 1}
+    registry.collector("cache", "gauge", "Cache stats", lambda: [({"stat": k}, v) for k, v in state.items()])
+    assert 'cache{stat="entries"} 1' in registry.render()
+    state["entries"] = 7
+    assert 'cache{stat="entries"} 7' in registry.render()
+
+
+def test_route_timing_folds_unknown_methods():
+    registry = Registry()
+    histogram = registry.histogram("duration", "test", labels=("method", "route", "status"))
+
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/items/{id}", ok, methods=["GET"])])
+    app.add_middleware(RouteTimingMiddleware, histogram=histogram)
+    client = TestClient(app)
+    client.get("/items/1")
+    for i in range(5):
+        client.request(f"X{i}", "/items/1")
+
+    assert sorted(histogram._children) == [("GET", "/items/{id}", "200"), ("other", "/items/{id}", "405")]
@@ -0,0 +1,109 @@
+import asyncio
+
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ConcurrencyLimiter, RateLimiter
+
+
+def test_opens_on_failure_rate_and_recovers_through_half_open(clock):
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, open_seconds=30, clock=clock)
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.now = 31
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=5, clock=clock)
+    breaker.record_failure()
+    clock.now = 6
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_abandoned_probe_frees_its_slot(clock):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=5, clock=clock)
+    breaker.record_failure()
+    clock.now = 6
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.abandon()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_probe_that_never_reports_back_reopens(clock):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=5, clock=clock)
+    breaker.record_failure()
+    clock.now = 6
+    assert breaker.allow()
+    clock.now = 11
+    assert breaker.state == OPEN
+    clock.now = 16
+    assert breaker.allow()
+
+
+def test_opens_on_slow_calls():
+    breaker = CircuitBreaker(slow_call_seconds=1.0, slow_call_rate=0.5, min_calls=2)
+    breaker.record_success(2.0)
+    breaker.record_success(3.0)
+    assert breaker.state == OPEN
+
+
+def test_rate_limiter_refills_per_key(clock):
+    limiter = RateLimiter(rate=1.0, burst=2, clock=clock)
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 1.0
+    assert limiter.acquire("b") == 0
+
+    clock.now = 0.5
+    assert limiter.acquire("a") == 0.5
+    clock.now = 1.5
+    assert limiter.acquire("a") == 0
+    assert limiter.stats()["rejected"] == 2
+
+
+def test_rate_limiter_forgets_least_recent_keys(clock):
+    limiter = RateLimiter(rate=1.0, burst=1, max_keys=2, clock=clock)
+    for key in ("a", "b", "c"):
+        limiter.acquire(key)
+    assert limiter.stats()["keys"] == 2
+    assert limiter.acquire("a") == 0  # forgotten, so full again
+    assert limiter.acquire("c") > 0
+
+
+def test_concurrency_limiter_hands_slots_to_waiters_in_order():
+    async def run():
+        limiter = ConcurrencyLimiter(limit=1, max_waiting=1, timeout=1.0)
+        assert await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not await limiter.acquire()  # queue is full
+        limiter.release()
+        assert await waiter
+        assert limiter.stats() == {"active": 1, "waiting": 0, "rejected": 1}
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(run())
+
+
+def test_concurrency_limiter_gives_up_after_timeout():
+    async def run():
+        limiter = ConcurrencyLimiter(limit=1, max_waiting=4, timeout=0.01)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+        assert limiter.stats() == {"active": 1, "waiting": 0, "rejected": 1}
+
+    asyncio.run(run())
@@ -0,0 +1,126 @@
+import asyncio
+
+from sse import Broadcast, HEARTBEAT, SSEParser, event_data, relay_events
+
+
+def test_parser_reassembles_split_and_merged_events():
+    parser = SSEParser()
+    assert parser.feed(b"data: hel") == []
+    assert parser.feed(b"lo\n\ndata: a\n\ndata: b\r") == [b"data: hello\n\n", b"data: a\n\n"]
+    assert parser.feed(b"\n\r\n") == [b"data: b\n\n"]
+    assert parser.feed(b"data: tail") == []
+    assert parser.flush() == b"data: tail\n\n"
+    assert parser.flush() is None
+
+
+def test_event_data_joins_data_lines():
+    assert event_data(b"event: token\ndata: one\ndata:two\n\n") == "one\ntwo"
+
+
+def test_relay_sends_heartbeats_during_pauses():
+    async def slow():
+        yield b"data: 1\n\n"
+        await asyncio.sleep(0.25)
+        yield b"data: 2\n\n"
+
+    async def run():
+        return [e async for e in relay_events(slow(), heartbeat_interval=0.1)]
+
+    out = asyncio.run(run())
+    assert out[0] == b"data: 1\n\n" and out[-1] == b"data: 2\n\n"
+    assert out.count(HEARTBEAT) >= 1
+
+
+def test_relay_applies_backpressure_and_cancels_upstream():
+    pulled = 0
+    closed = False
+
+    async def endless():
+        nonlocal pulled, closed
+        try:
+            while True:
+                pulled += 1
+                yield b"data: x\n\n"
+        finally:
+            closed = True
+
+    async def run():
+        stream = relay_events(endless(), max_buffered=4, heartbeat_interval=None)
+        assert await stream.__anext__() == b"data: x\n\n"
+        await asyncio.sleep(0.05)  # slow client: upstream should stall
+        stalled_at = pulled
+        await stream.aclose()
+        return stalled_at
+
+    stalled_at = asyncio.run(run())
+    assert stalled_at <= 4 + 2
+    assert closed
+
+
+def test_broadcast_replays_then_follows_live():
+    async def source():
+        for event in (b"data: 1\n\n", b"data: 2\n\n", b"data: 3\n\n"):
+            await asyncio.sleep(0.02)
+            yield event
+
+    async def run():
+        done = []
+        broadcast = Broadcast(source(), on_done=lambda: done.append(True))
+
+        async def collect(delay):
+            await asyncio.sleep(delay)
+            return [event async for event in broadcast.subscribe()]
+
+        results = await asyncio.gather(collect(0), collect(0.05))
+        assert results[0] == results[1] == [b"data: 1\n\n", b"data: 2\n\n", b"data: 3\n\n"]
+        assert done == [True]
+
+    asyncio.run(run())
+
+
+def test_broadcast_closes_source_when_last_subscriber_leaves():
+    closed = []
+
+    async def source():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield b"data: tick\n\n"
+        finally:
+            closed.append(True)
+
+    async def run():
+        broadcast = Broadcast(source())
+        stream = broadcast.subscribe()
+        assert await stream.__anext__() == b"data: tick\n\n"
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        assert broadcast.done
+        assert closed == [True]
+
+    asyncio.run(run())
+
+
+def test_late_joiner_on_a_closing_broadcast_gets_an_error():
+    async def source():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield b"data: partial\n\n"
+        finally:
+            # Closing upstream takes a while
+            await asyncio.sleep(0.05)
+
+    async def run():
+        closing = []
+        broadcast = Broadcast(source(), on_closing=lambda: closing.append(True))
+        stream = broadcast.subscribe()
+        assert await stream.__anext__() == b"data: partial\n\n"
+        await stream.aclose()
+        assert closing == [True] and broadcast.closing and not broadcast.done
+
+        late = [event async for event in broadcast.subscribe()]
+        assert late[:-1] == [b"data: partial\n\n"]
+        assert event_data(late[-1]) == '{"error": "Stream closed before it finished"}'
+
+    asyncio.run(run())
@@ -0,0 +1,80 @@
+import pstats
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.testclient import TestClient
+
+from tracing import ProfileSampler, RequestIdMiddleware, Trace, request_id_var
+
+
+def make_client(sampler=None):
+    async def echo(request):
+        return PlainTextResponse(request_id_var.get())
+
+    async def ws_echo(websocket):
+        await websocket.accept()
+        await websocket.send_text(request_id_var.get())
+        await websocket.close()
+
+    app = Starlette(routes=[Route("/echo", echo), WebSocketRoute("/ws", ws_echo)])
+    app.add_middleware(RequestIdMiddleware, sampler=sampler)
+    return TestClient(app)
+
+
+def test_trace_spans_run_from_mark_to_mark(clock):
+    trace = Trace("abc", clock=clock)
+    clock.now = 0.01
+    trace.mark("queue")
+    clock.now = 0.05
+    trace.mark("connect")
+    assert trace.spans == {"queue": 0.01, "connect": 0.04}
+    assert trace.server_timing() == "queue;dur=10.0, connect;dur=40.0"
+
+
+def test_request_id_is_kept_or_assigned():
+    client = make_client()
+    response = client.get("/echo", headers={"X-Request-Id": "upstream-123"})
+    assert response.text == "upstream-123"
+    assert response.headers["x-request-id"] == "upstream-123"
+
+    response = client.get("/echo")
+    assert len(response.text) == 32
+    assert response.headers["x-request-id"] == response.text
+
+    # Anything that could break log lines or file names is replaced
+    response = client.get("/echo", headers={"X-Request-Id": "../../etc/passwd"})
+    assert response.text != "../../etc/passwd"
+
+
+def test_sampled_requests_are_profiled_to_disk(tmp_path):
+    sampler = ProfileSampler(rate=1.0, directory=str(tmp_path))
+    client = make_client(sampler)
+    client.get("/echo", headers={"X-Request-Id": "sampled"})
+
+    dumps = list(tmp_path.glob("*-echo-sampled.prof"))
+    assert len(dumps) == 1 and sampler.dumped == 1
+    assert pstats.Stats(str(dumps[0])).total_calls > 0
+
+    sampler.rate = 0.0
+    client.get("/echo")
+    assert sampler.dumped == 1
+
+
+def test_only_one_request_is_profiled_at_a_time(tmp_path):
+    sampler = ProfileSampler(rate=1.0, directory=str(tmp_path))
+    first = sampler.start()
+    assert first is not None
+    assert sampler.start() is None
+    sampler.finish(first, "first")
+
+
+def test_websocket_connections_are_not_profiled(tmp_path):
+    sampler = ProfileSampler(rate=1.0, directory=str(tmp_path))
+    with make_client(sampler).websocket_connect("/ws") as ws:
+        assert ws.receive_text()
+    assert sampler.dumped == 0
+    # Nothing is left holding the single profiling slot
+    profiler = sampler.start()
+    assert profiler is not None
+    profiler.disable()
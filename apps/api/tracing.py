@@ -0,0 +1,142 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+REQUEST_ID_HEADER = "x-request-id"
+
+# Id of the request being handled; set by RequestIdMiddleware
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Incoming ids end up in log lines and profile file names, so keep them tame
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,128}$")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds ``request_id`` to log records, for use in format strings."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+
+class Trace:
+    """Consecutive timing spans of one request (queue, connect, ttfb, ...).
+
+    Each ``mark(name)`` closes a span that started at the previous mark.
+    """
+
+    def __init__(self, request_id: Optional[str] = None, clock: Callable[[], float] = time.perf_counter):
+        self.request_id = request_id
+        self.clock = clock
+        self.spans: Dict[str, float] = {}
+        self._last = clock()
+
+    def mark(self, name: str) -> float:
+        now = self.clock()
+        elapsed = now - self._last
+        self.spans[name] = self.spans.get(name, 0.0) + elapsed
+        self._last = now
+        return elapsed
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items())
+
+    def __str__(self) -> str:
+        return " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.spans.items())
+
+
+class ProfileSampler:
+    """Profiles a random fraction of requests with cProfile.
+
+    The profiler sees everything the event loop runs while the sampled
+    request is in flight, so only one request is profiled at a time. Each
+    profile is written to ``directory`` as a ``.prof`` file for pstats or
+    snakeviz. ``rate`` can be changed at runtime.
+    """
+
+    def __init__(self, rate: float = 0.0, directory: str = "profiles", rng: Callable[[], float] = random.random):
+        self.rate = rate
+        self.directory = directory
+        self.rng = rng
+        self.dumped = 0
+        self._active = False
+
+    def start(self) -> Optional[cProfile.Profile]:
+        if self.rate <= 0 or self._active or self.rng() >= self.rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler or debugger owns the hook
+            return None
+        self._active = True
+        return profiler
+
+    def finish(self, profiler: cProfile.Profile, name: str) -> str:
+        profiler.disable()
+        self._active = False
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}.prof")
+        profiler.dump_stats(path)
+        self.dumped += 1
+        return path
+
+
+class RequestIdMiddleware:
+    """ASGI middleware that gives every request an id and samples profiles.
+
+    Only HTTP requests are profiled; WebSocket connections just get an id.
+
+    A well-formed incoming ``X-Request-Id`` is kept, otherwise a new id is
+    assigned. The id is available through ``request_id_var`` while the
+    request runs and is echoed in the response headers.
+    """
+
+    def __init__(self, app, sampler: Optional[ProfileSampler] = None):
+        self.app = app
+        self.sampler = sampler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None or not _VALID_REQUEST_ID.match(request_id):
+            request_id = new_request_id()
+        header = (REQUEST_ID_HEADER.encode(), request_id.encode())
+
+        async def send_with_id(message):
+            if message["type"] in ("http.response.start", "websocket.accept"):
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        # WebSocket connections can stay open for hours; profiling one would
+        # slow the whole loop and block every other sample for that long
+        profiler = None
+        if self.sampler is not None and scope["type"] == "http":
+            profiler = self.sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+            if profiler is not None:
+                route = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_") or "root"
+                path = self.sampler.finish(profiler, f"{route}-{request_id}")
+                logging.getLogger("per4ex.api").info("Wrote profile of %s %s to %s", scope.get("method", "WS"), scope["path"], path)
@@ -4,6 +4,8 @@ import { NextRequest, NextResponse } from "next/server";
 const CATALYST_API_URL = process.env.CATALYST_API_URL || "http://localhost:8001/v1";
 const TENANT_ID = process.env.CATALYST_TENANT_ID || "catalyst-widget";
 const API_KEY = process.env.CATALYST_API_KEY;
+// Same rule as the Python API: incoming IDs end up in logs and file names
+const VALID_REQUEST_ID = /^[A-Za-z0-9._-]{1,128}$/;
 
 if (!API_KEY) {
   console.warn("CATALYST_API_KEY is not set. Chat functionality will fail.");
@@ -85,6 +87,12 @@ Panagiotis is not a "glue code" developer; he is a systems engineer. His philoso
         };
     }
 
+    // Forward the caller's request ID if it is well-formed, otherwise a fresh one
+    const incomingRequestId = req.headers.get("x-request-id");
+    const requestId = incomingRequestId && VALID_REQUEST_ID.test(incomingRequestId)
+      ? incomingRequestId
+      : crypto.randomUUID();
+
     // Forward to Catalyst Service
     const response = await fetch(`${CATALYST_API_URL}/chat/stream`, {
       method: "POST",
@@ -92,8 +100,8 @@ Panagiotis is not a "glue code" developer; he is a systems engineer. His philoso
         "Content-Type": "application/json",
         "Authorization": `Bearer ${API_KEY}`,
         "X-Tenant-Id": TENANT_ID,
-        // Forward request ID if useful for tracing
-        // "X-Request-Id": crypto.randomUUID()
+        // So the turn can be traced end to end
+        "X-Request-Id": requestId
       },
       body: JSON.stringify({
         messages: messages, // Just pass the user/assistant history
@@ -1,4 +1,10 @@
 #!/usr/bin/env python3
+"""Start the API and the web app on free local ports.
+
+    python bootstrap.py            dev servers with auto-reload
+    python bootstrap.py --prod     multi-worker API and a production Next.js build
+"""
+import argparse
 import socket
 import subprocess
 import os
@@ -16,7 +22,50 @@ def find_free_port(start_port):
                 return port
             port += 1
 
+def has_modules(python_cmd, *modules):
+    """Check which of ``modules`` the API interpreter (not this one) can import."""
+    probe = "import importlib.util, sys; print(' '.join(m for m in sys.argv[1:] if importlib.util.find_spec(m)))"
+    result = subprocess.run([python_cmd, "-c", probe, *modules], capture_output=True, text=True)
+    return set(result.stdout.split())
+
+def api_command(python_cmd, port, args):
+    """Build the uvicorn command line for dev or production."""
+    command = [python_cmd, "-m", "uvicorn", "main:app", "--port", str(port), "--host", args.host]
+    if not args.prod:
+        return command + ["--reload"]
+
+    # uvicorn[standard] ships both; fall back to the pure-Python ones if they are missing
+    available = has_modules(python_cmd, "uvloop", "httptools")
+    loop = "uvloop" if "uvloop" in available else "asyncio"
+    http = "httptools" if "httptools" in available else "h11"
+    print(f"⚙️  {args.workers} workers, {loop} event loop, {http} parser")
+    return command + [
+        "--workers", str(args.workers),
+        "--loop", loop,
+        "--http", http,
+        "--backlog", str(args.backlog),
+        "--timeout-keep-alive", str(args.keepalive),
+        "--timeout-graceful-shutdown", str(args.graceful_timeout),
+    ]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Start the API and the web app on free local ports.")
+    parser.add_argument("--prod", action="store_true",
+                        help="multi-worker API without the reloader, and next build/start instead of next dev")
+    parser.add_argument("--host", default="127.0.0.1", help="API bind address")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1),
+                        help="API worker processes in --prod (default: $WEB_CONCURRENCY or the CPU count)")
+    parser.add_argument("--backlog", type=int, default=2048,
+                        help="pending connections the listen socket holds in --prod")
+    parser.add_argument("--keepalive", type=int, default=30,
+                        help="seconds an idle keep-alive connection stays open in --prod")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="seconds open requests and chat streams get to finish on shutdown in --prod")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     root_dir = Path(__file__).parent.absolute()
     
     # 1. Configuration
@@ -53,9 +102,13 @@ def main():
         # We allow ALL origins in dev via env var if we wanted to be strict, 
         # but main.py has "*" for now.
         print("\n🚀 Launching FastAPI backend...")
+        if args.prod:
+            # Caches, rate limits and chat admission are per worker; set
+            # CACHE_BACKEND_URL to share the repo cache between them.
+            print("   (Per-process limits such as CHAT_MAX_CONCURRENT apply to each worker)")
         api_env = os.environ.copy()
         api_process = subprocess.Popen(
-            [python_cmd, "-m", "uvicorn", "main:app", "--reload", "--port", str(api_port), "--host", "127.0.0.1"],
+            api_command(python_cmd, api_port, args),
             cwd=str(api_dir),
             env=api_env
         )
@@ -70,10 +123,13 @@ def main():
         web_env["NEXT_PUBLIC_API_URL"] = f"http://localhost:{api_port}"
         web_env["PORT"] = str(web_port)
         
-        # Use npm run dev
+        # Use npm run dev (or build + start in --prod)
         # Note: 'npm run dev' usually runs 'next dev'. Next.js respects the PORT env var.
+        if args.prod:
+            # NEXT_PUBLIC_* values are inlined at build time, so build with the API URL set
+            subprocess.run(["npm", "run", "build"], cwd=str(web_dir), env=web_env, check=True)
         web_process = subprocess.Popen(
-            ["npm", "run", "dev"],
+            ["npm", "run", "start" if args.prod else "dev"],
             cwd=str(web_dir),
             env=web_env
         )
@@ -94,12 +150,16 @@ def main():
             
     except KeyboardInterrupt:
         print("\n🛑 Stopping services...")
+    except subprocess.CalledProcessError:
+        print("❌ Web build failed.")
     finally:
+        # Give uvicorn time to drain open streams before killing it
+        stop_timeout = args.graceful_timeout + 5 if args.prod else 2
         for p in processes:
             if p.poll() is None:
                 p.terminate()
                 try:
-                    p.wait(timeout=2)
+                    p.wait(timeout=stop_timeout)
                 except subprocess.TimeoutExpired:
                     p.kill()
         print("👋 Goodbye!")